@@ -1,17 +1,38 @@
 import pdfplumber
 from config import get_config
 import re
-from openai import AzureOpenAI
-from azure.cosmos import CosmosClient, ContainerProxy
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from azure.cosmos import CosmosClient
 import getopt
 import sys
 from pathlib import Path 
 import json
 from PIL import Image
 from io import BytesIO
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
 import uuid
 import pytesseract
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+import functools
+import tiktoken
+from array import array
+from base64 import b64decode
+import asyncio
+import threading
+from collections import deque
+from embedding_cache import EmbeddingCache, float32_to_list
+from artifact_cache import ArtifactCache, hash_file, hash_settings
+from vector_store import VectorStore, CosmosVectorStore
+from checkpoint_journal import CheckpointJournal
+from local_chunker import chunk_sentences
+from pipeline import Pipeline, PipelineStage, PipelineAborted
+from rate_limiter import RateLimiter
+from openai_throttle import OpenAIThrottle
+from run_metrics import RunMetrics
+import hashlib
+import copy
+import time
 
 def normalize_text(text: str):
     text = re.sub(r'\s+',  ' ', text).strip()
@@ -36,8 +57,122 @@ def strip_emails_and_phone_numbers_and_web_addresses(text):
 
     return text
 
+@functools.cache
+def get_tokenizer():
+    # cl100k_base is the encoding used by the text-embedding-3 and gpt-4 model families
+    return tiktoken.get_encoding("cl100k_base")
+
+def count_tokens(text: str):
+    return len(get_tokenizer().encode(text, disallowed_special=()))
+
+@functools.cache
+def get_run_metrics():
+    return RunMetrics()
+
+def start_run_metrics(vector_store: VectorStore):
+    run_metrics = get_run_metrics()
+    run_metrics.add_section("vectorStore", lambda: vector_store.get_report())
+    run_metrics.add_section("openai", lambda: { quota_name: get_openai_throttle(quota_name).get_report() for quota_name in ["Chat", "Embeddings"] })
+    interval_seconds = get_config("LiveSummaryIntervalSeconds")
+    run_metrics.start_live_summaries(float(interval_seconds) if interval_seconds else 0)
+
+def finish_run_metrics(run_name: str):
+    run_metrics = get_run_metrics()
+    run_metrics.stop_live_summaries()
+    report_location = get_config("RunReportLocation")
+    if not report_location:
+        print(f"Run report: {json.dumps(run_metrics.get_report(), indent=4)}")
+        return
+
+    print(f"Run report written to {run_metrics.write_report(report_location, run_name)}")
+
+def get_usage_tokens(response):
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage is not None else 0
+
+def batch_embedding_inputs(texts: list[str]):
+    max_items = get_config("EmbeddingsBatchSize")
+    max_items = int(max_items) if max_items else 64
+    max_tokens = get_config("EmbeddingsBatchTokens")
+    max_tokens = int(max_tokens) if max_tokens else 100000
+
+    batch = []
+    batch_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if len(batch) > 0 and (len(batch) >= max_items or batch_tokens + tokens > max_tokens):
+            yield batch
+            batch = []
+            batch_tokens = 0
+
+        batch.append(i)
+        batch_tokens += tokens
+
+    if len(batch) > 0:
+        yield batch
+
+def decode_embedding(encoded_embedding: str):
+    # base64 encoded embeddings are packed little endian float32 values, a quarter of the size of the JSON float list
+    return float32_to_list(array("f", b64decode(encoded_embedding)))
+
+@functools.cache
+def get_embedding_cache():
+    cache_location = get_config("EmbeddingCacheLocation")
+    if not cache_location:
+        return None
+
+    max_size_mb = get_config("EmbeddingCacheMaxMB")
+    return EmbeddingCache(cache_location, int(max_size_mb) if max_size_mb else 1024)
+
+@functools.cache
+def get_openai_throttle(quota_name: str):
+    # one throttle per deployment for the whole run, so documents indexed in parallel stay under the quota and back off together
+    tokens_per_minute = get_config(f"{quota_name}TokensPerMinute")
+    requests_per_minute = get_config(f"{quota_name}RequestsPerMinute")
+    rate_limiter = RateLimiter(int(tokens_per_minute), int(requests_per_minute)) if tokens_per_minute and requests_per_minute else None
+
+    max_concurrency = get_config(f"{quota_name}MaxConcurrency")
+    max_retries = get_config("OpenAIMaxRetries")
+    return OpenAIThrottle(quota_name, rate_limiter, int(max_concurrency) if max_concurrency else 16, int(max_retries) if max_retries else 8)
+
+def print_openai_throttle_report():
+    for quota_name in ["Chat", "Embeddings"]:
+        print(f"{quota_name} throttle report: {json.dumps(get_openai_throttle(quota_name).get_report())}")
+
+def request_embeddings(client: AzureOpenAI, texts: list[str]):
+    embeddings = [None] * len(texts)
+    for batch in batch_embedding_inputs(texts):
+        batch_tokens = sum(count_tokens(texts[i]) for i in batch)
+        with get_run_metrics().time("embed", items=len(batch), bytes=sum(len(texts[i].encode("utf-8")) for i in batch)) as counters:
+            response = get_openai_throttle("Embeddings").call(batch_tokens, lambda: client.embeddings.create(input = [texts[i] for i in batch], model = get_config("EmbeddingsModel"), encoding_format = "base64"))
+            counters["tokens"] = get_usage_tokens(response)
+        # the response carries the position of each input so map it back instead of trusting the ordering
+        for item in response.data:
+            embeddings[batch[item.index]] = decode_embedding(item.embedding)
+
+    return embeddings
+
+def generate_embeddings_batch(client: AzureOpenAI, texts: list[str]):
+    embedding_cache = get_embedding_cache()
+    if embedding_cache is None:
+        return request_embeddings(client, texts)
+
+    model = get_config("EmbeddingsModel")
+    embeddings = embedding_cache.get_many(texts, model)
+    missing_indexes = [i for i, embedding in enumerate(embeddings) if embedding is None]
+    if len(missing_indexes) > 0:
+        missing_texts = [texts[i] for i in missing_indexes]
+        missing_embeddings = request_embeddings(client, missing_texts)
+        embedding_cache.put_many(missing_texts, missing_embeddings, model)
+        for (i, embedding) in zip(missing_indexes, missing_embeddings):
+            embeddings[i] = embedding
+
+    get_run_metrics().record("embed", cacheHits=len(texts) - len(missing_indexes))
+    print(f"Embedding cache hits {len(texts) - len(missing_indexes)} of {len(texts)}")
+    return embeddings
+
 def generate_embeddings(client: AzureOpenAI, text: str):
-    return client.embeddings.create(input = [text], model = get_config("EmbeddingsModel")).data[0].embedding
+    return generate_embeddings_batch(client, [text])[0]
 
 def get_cosmos_container():
     client = CosmosClient(get_config("COSMOS_DB_URL"), get_config("COSMOS_DB_KEY"))
@@ -45,8 +180,8 @@ def get_cosmos_container():
     container = database.get_container_client(get_config("CONTAINER_NAME"))
     return container
 
-def create_document(cosmos_container: ContainerProxy, text: str, embeddings: list[float], chunk_number: int, model_type: str, document_type: str):
-    item = {
+def build_document(text: str, embeddings: list[float], chunk_number: int, model_type: str, document_type: str):
+    return {
         "id": f"{document_type}_{chunk_number}",
         "modelType": model_type,
         "text": text,
@@ -54,97 +189,658 @@ def create_document(cosmos_container: ContainerProxy, text: str, embeddings: lis
         "documentType": document_type,
         "partitionKey": model_type
     }
-    cosmos_container.upsert_item(item)
+
+@functools.cache
+def get_vector_store() -> VectorStore:
+    # cached so every document and thread writes through the same store and its numbers add up over the whole run
+    if get_config("VectorStore") == "local":
+        # only the local store needs numpy so it's only imported when it's used
+        from local_vector_store import LocalVectorStore
+        print(f"Using the local vector store at {get_config('LocalVectorStoreLocation')}")
+        return LocalVectorStore(get_config("LocalVectorStoreLocation"))
+
+    mode = get_config("CosmosBulkMode")
+    max_concurrency = get_config("CosmosMaxConcurrency")
+    return CosmosVectorStore(get_cosmos_container(), mode if mode else "batch", int(max_concurrency) if max_concurrency else 8)
+
+def create_document(vector_store: VectorStore, text: str, embeddings: list[float], chunk_number: int, model_type: str, document_type: str):
+    item = build_document(text, embeddings, chunk_number, model_type, document_type)
+    with get_run_metrics().time("upsert", items=1, bytes=len(json.dumps(item))):
+        vector_store.upsert_item(item)
+
+def create_documents(vector_store: VectorStore, items: list[dict]):
+    # request units are reported by the store itself, see the store section of the run report
+    with get_run_metrics().time("upsert", items=len(items), bytes=sum(len(json.dumps(item)) for item in items)):
+        vector_store.upsert_items(items)
+
+def print_vector_store_report(vector_store: VectorStore):
+    print(f"Vector store report: {json.dumps(vector_store.get_report())}")
 
 def upload_fact_sheet(): 
     print('Uploading Fact Sheet')
 
-    cosmos_container = get_cosmos_container()
+    vector_store = get_vector_store()
+    start_run_metrics(vector_store)
 
-    openai_client = AzureOpenAI(
-        api_key = get_config("AZURE_OPENAI_API_KEY"),
-        api_version = "2024-02-01",
-        azure_endpoint = get_config("AZURE_OPENAI_ENDPOINT")
-    )
+    openai_client = get_openai_client()
 
     fact_sheet = get_config("FactSheetLocation")
     
+    normalized_page_texts = []
     with pdfplumber.open(fact_sheet) as pdf:
-        for i, page in enumerate(pdf.pages):
+        for page in pdf.pages:
             page_text = page.extract_text()
             page.flush_cache()
-            normalized_page_text = normalize_text(page_text)
+            normalized_page_texts.append(normalize_text(page_text))
+
+    page_embeddings = generate_embeddings_batch(openai_client, normalized_page_texts)
 
-            embeddings = generate_embeddings(openai_client, normalized_page_text)
+    partition_key = get_config("PartitionKey")
+    print(f"Saving {len(normalized_page_texts)} pages")
+    items = [build_document(normalized_page_text, embeddings, i, partition_key, "FactSheet") for i, (normalized_page_text, embeddings) in enumerate(zip(normalized_page_texts, page_embeddings))]
+    create_documents(vector_store, items)
+    print_vector_store_report(vector_store)
+    print_openai_throttle_report()
+    finish_run_metrics("FactSheet")
+
+def get_chunk_number(item_id: str):
+    id_parts = item_id.split("_")
+    return int(id_parts[-1]) if len(id_parts) > 1 and id_parts[-1].isdigit() else None
 
-            partition_key = get_config("PartitionKey")
-            print(f"Saving page {i+1}")
-            create_document(cosmos_container, normalized_page_text, embeddings, i, partition_key, "FactSheet")
+def query_document_type_ids(vector_store: VectorStore, partition_key: str, document_type: str, starting_at: int = 0):
+    item_ids = []
+    for item_id in vector_store.query_document_type_ids(partition_key, document_type):
+        # filtering on the chunk number here instead of in the query keeps the query a simple indexed lookup
+        chunk_number = get_chunk_number(item_id)
+        if starting_at == 0 or (chunk_number is not None and chunk_number >= starting_at):
+            item_ids.append(item_id)
+
+    print(f"Found {len(item_ids)} items to delete")
+    return item_ids
 
 def delete_document_type(document_type: str, starting_at: int = 0):
     print(f'Deleting document {document_type}')
-    cosmos_container = get_cosmos_container()
+    vector_store = get_vector_store()
     partition_key = get_config("PartitionKey")
-    partition_key = partition_key
-    query = f"SELECT * FROM c WHERE c.partitionKey = '{partition_key}' AND c.documentType = '{document_type}' AND StringToNumber(StringSplit(c.id, '_')[1]) >= {starting_at}"
-    items = cosmos_container.query_items(query=query, enable_cross_partition_query=False)
-    deleted_count = 0
-    for item in items:
-        try:
-            cosmos_container.delete_item(item=item['id'], partition_key=partition_key)
-            deleted_count += 1
-        except Exception as e:
-            print(f"Failed to delete item {item['id']}: {str(e)}")
+    item_ids = query_document_type_ids(vector_store, partition_key, document_type, starting_at)
 
-        if deleted_count % 100 == 0:
-            print(f'Deleted {deleted_count} items')
+    deleted_count = 0
+    for i in range(0, len(item_ids), 1000):
+        deleted_count += vector_store.delete_items(item_ids[i:i + 1000], partition_key)
+        print(f'Deleted {deleted_count} of {len(item_ids)} items, {vector_store.get_report().get("requestCharge", 0):.2f} RU so far')
     
     print(f'Deleted {deleted_count} items')
+    if document_type == "FinalRuling":
+        forget_deleted_chunks(vector_store, partition_key, starting_at)
+    print_vector_store_report(vector_store)
+
+def get_openai_client():
+    # retries are handled by the throttle, letting the SDK retry too would multiply them
+    return AzureOpenAI(
+        api_key = get_config("AZURE_OPENAI_API_KEY"),
+        api_version = "2024-02-01",
+        azure_endpoint = get_config("AZURE_OPENAI_ENDPOINT"),
+        max_retries = 0
+    )
+
+def get_async_openai_client():
+    return AsyncAzureOpenAI(
+        api_key = get_config("AZURE_OPENAI_API_KEY"),
+        api_version = "2024-02-01",
+        azure_endpoint = get_config("AZURE_OPENAI_ENDPOINT"),
+        max_retries = 0
+    )
+
+def get_chunking_messages(text):
+    return [{
+        "role": "user",
+        "content": f'''
+            Take the following "Text:" and break it into logically grouped chunks, ensuring each chunk maintains contextual meaning. 
+                * Keep all original text intact. Separate the chunks using |||| as a delimiter, outputting the result as a single line. 
+                * Do not add extra characters or summaries, —just return the original text chunked appropriately.  
+                * Remove any chunks that aren't necessary for RAG. 
+                * Remove any emails, phone numbers, web addresses.
+                * If there is no text provided then simply respond with "No Chunks"
+
+            Text:
+            {text}
+        ''',
+    }]
+
+def parse_chunked_text(chat_completion):
+    chunked_text = chat_completion.choices[0].message.content
+    chunked_text = "" if not chunked_text else chunked_text.strip()
+    return chunked_text.split("||||") if chunked_text != "No Chunks" else []
+
+def get_local_chunk_token_limits():
+    target_tokens = get_config("LocalChunkTargetTokens")
+    max_tokens = get_config("LocalChunkMaxTokens")
+    return (int(target_tokens) if target_tokens else 120, int(max_tokens) if max_tokens else 250)
+
+def estimate_chunking_tokens(messages):
+    # the response repeats the page back with delimiters added, so it costs about as much as the prompt again
+    return 2 * sum(count_tokens(message["content"]) for message in messages)
+
+def chunk_text_with_ai(text, openai_client):
+    messages = get_chunking_messages(text)
+    chat_completion = get_openai_throttle("Chat").call(estimate_chunking_tokens(messages), lambda: openai_client.chat.completions.create(
+        messages=messages,
+        model=get_config("ChatModel")
+    ))
+    get_run_metrics().record("chunk", tokens=get_usage_tokens(chat_completion))
+
+    return parse_chunked_text(chat_completion)
+
+def chunk_text_locally(text):
+    # sentence aware and sized by tokens, no network involved so it's deterministic and takes milliseconds per page
+    normalized_page_text = normalize_text(strip_emails_and_phone_numbers_and_web_addresses(text))
+    (target_tokens, max_tokens) = get_local_chunk_token_limits()
+    return chunk_sentences(normalized_page_text, target_tokens, max_tokens, count_tokens)
 
 def chunk_text(text, openai_client):
-    if get_config("UseAIChunking"):
-        messages = [{
-            "role": "user",
-            "content": f'''
-                Take the following "Text:" and break it into logically grouped chunks, ensuring each chunk maintains contextual meaning. 
-                    * Keep all original text intact. Separate the chunks using |||| as a delimiter, outputting the result as a single line. 
-                    * Do not add extra characters or summaries, —just return the original text chunked appropriately.  
-                    * Remove any chunks that aren't necessary for RAG. 
-                    * Remove any emails, phone numbers, web addresses.
-                    * If there is no text provided then simply respond with "No Chunks"
-
-                Text:
-                {text}
-            ''',
-        }]
-
-        chat_completion = openai_client.chat.completions.create(
+    with get_run_metrics().time("chunk", items=1, bytes=len(text.encode("utf-8"))):
+        if get_config("UseAIChunking"):
+            return chunk_text_with_ai(text, openai_client)
+
+        if get_config("UseLocalChunking"):
+            return chunk_text_locally(text)
+        
+        normalized_page_text = strip_emails_and_phone_numbers_and_web_addresses(text)
+        normalized_page_text = normalize_text(text)
+        return normalized_page_text.split(get_config("ChunkingCharacter"))
+
+async def chunk_text_async(text, async_openai_client):
+    messages = get_chunking_messages(text)
+    with get_run_metrics().time("chunk", items=1, bytes=len(text.encode("utf-8"))) as counters:
+        chat_completion = await get_openai_throttle("Chat").call_async(estimate_chunking_tokens(messages), lambda: async_openai_client.chat.completions.create(
             messages=messages,
             model=get_config("ChatModel")
-        )
+        ))
+        counters["tokens"] = get_usage_tokens(chat_completion)
+
+    return parse_chunked_text(chat_completion)
+
+def chunk_page(text, openai_client):
+    chunks = chunk_text(text, openai_client)
+    if len(chunks) == 0 and len(text) >= 20:
+        print("0 chunks found but normalized text isn't tiny.  Trying again")
+        chunks = chunk_text(text, openai_client)
+
+    return chunks
+
+async def chunk_page_async(text, async_openai_client):
+    chunks = await chunk_text_async(text, async_openai_client)
+    if len(chunks) == 0 and len(text) >= 20:
+        print("0 chunks found but normalized text isn't tiny.  Trying again")
+        chunks = await chunk_text_async(text, async_openai_client)
+
+    return chunks
+
+def get_chunking_settings():
+    # hashing the prompt itself means any change to it invalidates previously cached chunks
+    prompt = get_chunking_messages("{text}")[0]["content"]
+    return {
+        "useAIChunking": bool(get_config("UseAIChunking")),
+        "useLocalChunking": bool(get_config("UseLocalChunking")),
+        "localChunkTokenLimits": get_local_chunk_token_limits(),
+        "chatModel": get_config("ChatModel"),
+        "prompt": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+        "chunkingCharacter": get_config("ChunkingCharacter")
+    }
+
+def get_cached_chunks(page_number, document_artifacts):
+    # only AI chunking is slow enough to be worth caching
+    if not get_config("UseAIChunking") or document_artifacts is None:
+        return None
+
+    cached_chunks = document_artifacts.get_chunks(page_number)
+    if cached_chunks is not None:
+        print(f"Using cached chunks for page {page_number}")
+    return cached_chunks
+
+def cache_chunks(page_number, chunks, document_artifacts):
+    # empty results aren't cached so the next run gets another chance at chunking the page
+    if get_config("UseAIChunking") and document_artifacts is not None and len(chunks) > 0:
+        document_artifacts.put_chunks(page_number, chunks)
+
+def complete_chunked_page(chunked_page, document_artifacts):
+    (i, text, future, from_cache) = chunked_page
+    chunks = future.result()
+    if not from_cache:
+        cache_chunks(i+1, chunks, document_artifacts)
+
+    return (i, text, chunks)
+
+def chunk_pages(pages, openai_client, document_artifacts = None):
+    # takes an iterable of (page index, page text) and yields (page index, page text, chunks) in the same order
+    if not get_config("UseAIChunking"):
+        for (i, text) in pages:
+            yield (i, text, chunk_page(text, openai_client))
+        return
+
+    max_in_flight = get_config("MaxConcurrentChunking")
+    max_in_flight = int(max_in_flight) if max_in_flight else 1
+
+    # the pages are independent so keep a window of chat completions running on a background event loop
+    # while the caller keeps pulling pages, results are handed back oldest first so page order is preserved
+    loop = asyncio.new_event_loop()
+    loop_thread = threading.Thread(target=loop.run_forever, daemon=True)
+    loop_thread.start()
+    async_openai_client = get_async_openai_client()
+    in_flight = deque()
+    try:
+        for (i, text) in pages:
+            cached_chunks = get_cached_chunks(i+1, document_artifacts)
+            if cached_chunks is not None:
+                future = Future()
+                future.set_result(cached_chunks)
+            else:
+                future = asyncio.run_coroutine_threadsafe(chunk_page_async(text, async_openai_client), loop)
+            in_flight.append((i, text, future, cached_chunks is not None))
+
+            if len(in_flight) >= max_in_flight:
+                yield complete_chunked_page(in_flight.popleft(), document_artifacts)
+
+        while len(in_flight) > 0:
+            yield complete_chunked_page(in_flight.popleft(), document_artifacts)
+    finally:
+        for (_, _, future, _) in in_flight:
+            future.cancel()
+        asyncio.run_coroutine_threadsafe(async_openai_client.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        loop_thread.join()
+        loop.close()
+
+
+def init_ocr_worker():
+    # tesseract spins up its own OpenMP threads per call, with one worker process per core that just oversubscribes the machine
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+
+def ocr_image(image):
+    return pytesseract.image_to_string(image)
+
+def get_ocr_executor():
+    ocr_workers = get_config("OcrWorkers")
+    ocr_workers = int(ocr_workers) if ocr_workers else 1
+    if ocr_workers <= 1:
+        return None
+
+    print(f"Using {ocr_workers} OCR workers")
+    return ProcessPoolExecutor(max_workers=ocr_workers, initializer=init_ocr_worker)
+
+def submit_ocr(images, ocr_executor):
+    # the workers start on a window as soon as it's rendered, without an executor the pages are OCR'd when they're collected
+    if ocr_executor is None:
+        return None
+
+    return [ocr_executor.submit(ocr_image, image) for image in images]
+
+def get_render_dpi():
+    dpi = get_config("RenderDpi")
+    return int(dpi) if dpi else 200
+
+def get_render_threads():
+    render_threads = get_config("RenderThreads")
+    return int(render_threads) if render_threads else 1
+
+def get_render_options(output_folder = None):
+    if get_config("InMemoryOcr"):
+        # poppler streams the page straight back instead of writing a file for it, and a grayscale page is a third the size
+        # of an RGB one while tesseract binarizes the image before recognizing anything anyway
+        return { "dpi": get_render_dpi(), "grayscale": True }
+
+    return { "dpi": get_render_dpi(), "output_folder": output_folder }
+
+def should_save_page_images():
+    # nothing reads the page images during a run, they're only kept around to look into bad OCR
+    return not get_config("InMemoryOcr") or bool(get_config("SaveDebugImages"))
+
+def get_ocr_settings():
+    ocr_settings = {
+        "extractor": "tesseract",
+        "dpi": get_render_dpi(),
+        "tesseractVersion": str(pytesseract.get_tesseract_version()),
+        "grayscale": bool(get_config("InMemoryOcr"))
+    }
+
+    if get_config("UseTextLayerWhenUsable"):
+        ocr_settings["extractor"] = "hybrid"
+        ocr_settings["minTextLayerDensity"] = get_min_text_layer_density()
+        ocr_settings["maxTextLayerGarbageRatio"] = get_max_text_layer_garbage_ratio()
+
+    return ocr_settings
+
+def get_min_text_layer_density():
+    min_density = get_config("MinTextLayerDensity")
+    return float(min_density) if min_density else 5.0
+
+def get_max_text_layer_garbage_ratio():
+    max_garbage_ratio = get_config("MaxTextLayerGarbageRatio")
+    return float(max_garbage_ratio) if max_garbage_ratio else 0.1
+
+def score_text_layer(text: str, page_width: float, page_height: float):
+    # returns (characters per square inch, fraction of characters that look like garbage)
+    text = re.sub(r'\s+', '', text or '')
+    if len(text) == 0:
+        return (0.0, 1.0)
+
+    # pdfplumber emits (cid:123) for glyphs it can't map back to a character, that's a broken font and not real text
+    cid_matches = re.findall(r'\(cid:\d+\)', text)
+    text = re.sub(r'\(cid:\d+\)', '', text)
+    garbage_characters = len(re.findall(r'[^\w.,;:!?\'"()\[\]{}<>\-–—/\\&%$#@*+=§¶•●‘’“”]', text)) + len(cid_matches)
+    total_characters = len(text) + len(cid_matches)
+
+    area_square_inches = (page_width / 72) * (page_height / 72)
+    density = total_characters / area_square_inches if area_square_inches > 0 else 0.0
+    return (density, garbage_characters / total_characters)
+
+def extract_usable_text_layer(page):
+    with get_run_metrics().time("textLayer", items=1) as counters:
+        text = page.extract_text()
+        page.flush_cache()
+        counters["bytes"] = len((text or "").encode("utf-8"))
+    (density, garbage_ratio) = score_text_layer(text, page.width, page.height)
+    if density < get_min_text_layer_density() or garbage_ratio > get_max_text_layer_garbage_ratio():
+        print(f"Text layer on page {page.page_number} isn't usable (density {density:.1f}, garbage ratio {garbage_ratio:.2f}), falling back to OCR")
+        return None
+
+    return text
+
+@functools.cache
+def get_artifact_cache():
+    cache_location = get_config("ArtifactCacheLocation")
+    if not cache_location:
+        return None
+
+    return ArtifactCache(cache_location)
+
+def get_document_artifacts(document, ocr_settings):
+    artifact_cache = get_artifact_cache()
+    if artifact_cache is None:
+        return None
+
+    document_artifacts = artifact_cache.for_document(document["Location"], document["Name"], ocr_settings, get_chunking_settings())
+    print(f"Using artifact cache for document hash {document_artifacts.document_hash}")
+    return document_artifacts
+
+def get_known_page_text(page_number, document_artifacts, text_layer_pdf):
+    # returns (text, whether it came from the text layer), the text is None when the page has to be rendered and OCR'd
+    cached_text = document_artifacts.get_raw_text(page_number) if document_artifacts is not None else None
+    if cached_text is not None:
+        print(f"Using cached text for page {page_number}")
+        return (cached_text, False)
+
+    if text_layer_pdf is not None:
+        text_layer = extract_usable_text_layer(text_layer_pdf.pages[page_number - 1])
+        if text_layer is not None:
+            return (text_layer, True)
+
+    return (None, False)
+
+def get_page_runs(page_numbers):
+    # groups sorted page numbers into (first, last) runs of consecutive pages so each run is a single render call
+    runs = []
+    for page_number in page_numbers:
+        if len(runs) > 0 and runs[-1][1] == page_number - 1:
+            runs[-1] = (runs[-1][0], page_number)
+        else:
+            runs.append((page_number, page_number))
+    return runs
+
+def get_render_window_size(document_location, sample_page_number):
+    window_size = get_config("RenderWindowSize")
+    window_size = int(window_size) if window_size else 10
+
+    memory_limit = get_config("RenderMemoryLimitMB")
+    if memory_limit:
+        # every page in a document renders at the same dpi so the first one that needs rendering is a good enough estimate for the rest
+        sample_page = convert_from_path(document_location, first_page=sample_page_number, last_page=sample_page_number, **get_render_options())[0]
+        # the raw pixel buffer plus the copy that gets handed to the OCR workers, for this window and the next one that
+        # renders while this one is OCR'd
+        page_bytes = sample_page.width * sample_page.height * len(sample_page.getbands()) * 4
+        sample_page.close()
+        window_size = max(1, min(window_size, (int(memory_limit) * 1024 * 1024) // page_bytes))
+
+    print(f"Rendering {window_size} pages at a time")
+    return window_size
+
+def render_window(document_location, output_folder, ocr_executor, window):
+    # window is a list of (page number, known text) in page order, pages we already have text for never get rendered or OCR'd.
+    # poppler splits each run of pages across RenderThreads processes
+    images = []
+    try:
+        for (run_first_page, run_last_page) in get_page_runs([page_number for (page_number, known_text) in window if known_text is None]):
+            with get_run_metrics().time("render", items=run_last_page - run_first_page + 1):
+                images.extend(convert_from_path(document_location, first_page=run_first_page, last_page=run_last_page, thread_count=min(get_render_threads(), run_last_page - run_first_page + 1), **get_render_options(output_folder)))
+    except:
+        for page_image in images:
+            page_image.close()
+        raise
+
+    return (images, submit_ocr(images, ocr_executor))
+
+def discard_rendered_window(rendered_window):
+    try:
+        (images, ocr_futures) = rendered_window.result()
+    except Exception:
+        return
+
+    for ocr_future in ocr_futures or []:
+        ocr_future.cancel()
+    for page_image in images:
+        page_image.close()
+
+def ocr_rendered_window(document_artifacts, window, rendered_window):
+    (images, ocr_futures) = rendered_window.result()
+    try:
+        rendered_pages = 0
+        for (page_number, known_text) in window:
+            if known_text is not None:
+                yield (page_number - 1, None, known_text)
+                continue
+
+            page_image = images[rendered_pages]
+            # with worker processes this is the time spent waiting on them rather than the OCR itself
+            with get_run_metrics().time("ocr", items=1) as counters:
+                text = ocr_futures[rendered_pages].result() if ocr_futures is not None else ocr_image(page_image)
+                counters["bytes"] = len(text.encode("utf-8"))
+            rendered_pages += 1
+            if document_artifacts is not None:
+                document_artifacts.put_raw_text(page_number, text)
+            yield (page_number - 1, page_image, text)
+    finally:
+        for ocr_future in ocr_futures or []:
+            ocr_future.cancel()
+        for page_image in images:
+            page_image.close()
+
+def render_and_ocr_pages(document_location, output_folder, ocr_executor, document_artifacts = None, start_page = 1, use_text_layer = False):
+    # only a couple of windows of rendered pages are ever held in memory so peak usage depends on the window size and not the
+    # page count. the window is sized by rendering a sample page, so that only happens once some page actually needs rendering
+    page_count = pdfinfo_from_path(document_location)["Pages"]
+    print(f"Found {page_count} pages")
+
+    text_layer_pdf = pdfplumber.open(document_location) if use_text_layer else None
+    # poppler runs as a subprocess so a single thread is enough to render the next window while this one is OCR'd
+    render_executor = ThreadPoolExecutor(max_workers=1)
+    text_layer_pages = 0
+    ocr_pages = 0
+    window_size = None
+    window = []
+    pending_window = None
+    try:
+        for page_number in range(start_page, page_count + 1):
+            (known_text, from_text_layer) = get_known_page_text(page_number, document_artifacts, text_layer_pdf)
+            if from_text_layer:
+                text_layer_pages += 1
+
+            if known_text is None:
+                if window_size is None:
+                    window_size = get_render_window_size(document_location, page_number)
+                ocr_pages += 1
+
+            window.append((page_number, known_text))
+            pages_to_render = len([p for (p, text) in window if text is None])
+            # with nothing to render there's no reason to hold on to pages we already have text for, and with a page waiting
+            # to be rendered only a window's worth of them queue up behind it so the rest of the run isn't held up
+            if pages_to_render == 0 or len(window) >= window_size or page_number == page_count:
+                previous_window = pending_window
+                pending_window = (window, render_executor.submit(render_window, document_location, output_folder, ocr_executor, window))
+                window = []
+                if previous_window is not None:
+                    yield from ocr_rendered_window(document_artifacts, *previous_window)
+
+        if pending_window is not None:
+            (last_window, pending_window) = (pending_window, None)
+            yield from ocr_rendered_window(document_artifacts, *last_window)
+    finally:
+        # a window that was rendered ahead but never handed back still holds its images
+        if pending_window is not None:
+            discard_rendered_window(pending_window[1])
+        render_executor.shutdown()
+        if text_layer_pdf is not None:
+            text_layer_pdf.close()
+
+    print(f"Used the text layer for {text_layer_pages} page(s) and OCR'd {ocr_pages} page(s)")
+
+def save_ocr_page(run_directory_path, page_number, page_image, text):
+    # returns the normalized text or None when the page isn't worth indexing
+    if page_image is not None and should_save_page_images():
+        page_image.save(run_directory_path.joinpath(f"page_{page_number}.png"), "PNG")
+    with open(run_directory_path.joinpath(f"page_text_raw_{page_number}.txt"), "w") as w:
+        w.write(text) 
+
+    normalized_text = normalize_text(text)
+
+    with open(run_directory_path.joinpath(f"page_text_normalized_{page_number}.txt"), "w") as w:
+        w.write(normalized_text) 
+
+    normalized_text = normalized_text.strip()
+    if len(normalized_text) <= 3:
+        print(f"Skipping page, there is probably nothing of value to index. Text: '{normalized_text}'")
+        return None
+
+    return normalized_text
+
+def prepare_ocr_pages(document_location, run_directory_path, raw_directory_path, ocr_executor, document_artifacts = None, start_page = 1):
+    for (i, page_image, text) in render_and_ocr_pages(document_location, raw_directory_path, ocr_executor, document_artifacts, start_page, bool(get_config("UseTextLayerWhenUsable"))):
+        print(f"Processing page {i+1}")
+        normalized_text = save_ocr_page(run_directory_path, i+1, page_image, text)
+        if normalized_text is None:
+            continue
+
+        yield (i, normalized_text)
+
+def save_page_chunks(run_directory_path, page_number, chunks):
+    # reprocessing a previous run picks the chunks back up from these files
+    with open(run_directory_path.joinpath(f"page_text_chunks_{page_number}.txt"), "w") as w:
+        w.write(json.dumps(chunks))
+
+def check_page_chunks(chunks, page_text):
+    if len(chunks) <= 3:
+        print(f"QUALITY CONTROL!!!!")
+        print(f"Only {len(chunks)} Chunks Found. Chunks: {chunks}")
+
+    if len(chunks) == 0 and len(page_text) >= 20:
+        print(f"QUALITY CONTROL!!!!")
+        print(f"Still Only 0 Chunks Found. Chunks: {chunks}")
+        print(f"Taking entire page")
+        # just take the whole page if we really can't chunk it up for some reason
+        chunks.append(page_text)
+
+    return chunks
 
-        chunked_text = chat_completion.choices[0].message.content
-        chunked_text = "" if not chunked_text else chunked_text.strip()
-        return chunked_text.split("||||") if chunked_text != "No Chunks" else []
+def new_spool_state(total_chunks, total_chunks_uploaded, chunk_number_limit = None):
+    # plain lists and numbers so the whole thing can be written to the checkpoint journal as is
+    return {
+        "textAccumulator": [],
+        "chunkAccumulator": [],
+        "totalChunks": total_chunks,
+        "totalChunksUploaded": total_chunks_uploaded,
+        "firstChunkNumber": total_chunks_uploaded,
+        "chunkNumberLimit": chunk_number_limit
+    }
+
+def check_chunk_number_limit(spool_state, document):
+    # documents indexed in parallel each own a block of ids, running past it would overwrite the next document's chunks
+    chunk_number_limit = spool_state.get("chunkNumberLimit")
+    if chunk_number_limit is not None and spool_state["totalChunksUploaded"] > chunk_number_limit:
+        raise ValueError(f"'{document['Name']}' needs more chunk ids than its range allows, increase ChunkIdRangeSize")
+
+def get_spool_uploader(vector_store, overlap_size, openai_client, checkpoint_journal = None):
+    # uploads a spooled set of chunks right away, the pipeline swaps this for one that hands the upload to its embed and upsert stages
+    def upload_spool(chunk_accumulator, ignore_last_index, total_chunks, total_already_uploaded, checkpoint, first_chunk_number):
+        create_documents(vector_store, embed_chunks(openai_client, chunk_accumulator, overlap_size, ignore_last_index, total_chunks, total_already_uploaded, first_chunk_number))
+        if checkpoint_journal is not None and checkpoint is not None:
+            checkpoint_journal.record_progress(*checkpoint)
+
+    return upload_spool
+
+def spool_page_chunks(spool_state, document, page_number, chunks, chunk_size, spooling_size, upload_spool):
+    for j, text_chunk in enumerate(chunks):
+        cleaned_up_text = text_chunk.strip()
+        # we don't want to index empty strings
+        if len(cleaned_up_text) == 0:
+            continue
+
+        spool_state["textAccumulator"].append(f'<Chunk><DocumentName>{document["Name"]}</DocumentName><DocumentDescription>{document["Description"]}</DocumentDescription><Page>{page_number}</Page><Text>{cleaned_up_text}</Text></Chunk>')
+        if len(spool_state["textAccumulator"]) > chunk_size:
+            spool_state["chunkAccumulator"].append(spool_state["textAccumulator"])
+            spool_state["totalChunks"]+=1
+            spool_state["textAccumulator"] = []
+        
+        if len(spool_state["chunkAccumulator"]) == spooling_size:
+            chunk_accumulator = spool_state["chunkAccumulator"]
+            total_already_uploaded = spool_state["totalChunksUploaded"]
+            spool_state["totalChunksUploaded"]+=(len(chunk_accumulator)-1)
+            spool_state["chunkAccumulator"] = chunk_accumulator[(spooling_size-1):]
+            check_chunk_number_limit(spool_state, document)
+            # once this upload is stored everything before this point is durable, a resume picks back up with the rest of this page
+            checkpoint = (document["Name"], page_number, chunks[j+1:], copy.deepcopy(spool_state))
+            upload_spool(chunk_accumulator, True, spool_state["totalChunks"], total_already_uploaded, checkpoint, spool_state.get("firstChunkNumber"))
+
+def flush_spool(spool_state, document, upload_spool):
+    if len(spool_state["textAccumulator"]) != 0:
+        spool_state["chunkAccumulator"].append(spool_state["textAccumulator"])
+        spool_state["totalChunks"]+=1
+        spool_state["textAccumulator"] = []
     
-    normalized_page_text = strip_emails_and_phone_numbers_and_web_addresses(text)
-    normalized_page_text = normalize_text(text)
-    return normalized_page_text.split(get_config("ChunkingCharacter"))
+    chunk_accumulator = spool_state["chunkAccumulator"]
+    total_already_uploaded = spool_state["totalChunksUploaded"]
+    spool_state["totalChunksUploaded"]+=len(chunk_accumulator)
+    spool_state["chunkAccumulator"] = []
+    check_chunk_number_limit(spool_state, document)
+    upload_spool(chunk_accumulator, False, spool_state["totalChunks"], total_already_uploaded, None, spool_state.get("firstChunkNumber"))
 
+def resume_spool(document, chunk_size, spooling_size, upload_spool, total_chunks, total_chunks_uploaded, resume_state, chunk_number_limit = None):
+    # returns the spool state and the first page that still needs to be processed
+    if resume_state is None:
+        return (new_spool_state(total_chunks, total_chunks_uploaded, chunk_number_limit), 1)
 
-def index_using_pdf_to_image(document, chunk_size, spooling_size, cosmos_container, overlap_size, openai_client, total_chunks, total_chunks_uploaded):    
-    chunk_accumulator = []
-    text_accumulator = []
+    print(f"Resuming '{document['Name']}' at page {resume_state['pageNumber']}")
+    spool_state = resume_state["spool"]
+    spool_state["chunkNumberLimit"] = chunk_number_limit
+    spool_page_chunks(spool_state, document, resume_state["pageNumber"], resume_state["remainingPageChunks"], chunk_size, spooling_size, upload_spool)
+    return (spool_state, resume_state["pageNumber"] + 1)
 
+def index_using_pdf_to_image(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal = None, resume_state = None, chunk_number_limit = None):    
     run_directory_name = document["PreviousRunId"] if "PreviousRunId" in document else str(uuid.uuid4())
     run_directory_path = Path(get_config("TempImageLocation")).joinpath(run_directory_name)
     raw_directory_path = run_directory_path.joinpath("raw")
     raw_directory_path.mkdir(exist_ok=True, parents=True)
 
+    upload_spool = get_spool_uploader(vector_store, overlap_size, openai_client, checkpoint_journal)
+    (spool_state, start_page) = resume_spool(document, chunk_size, spooling_size, upload_spool, total_chunks, total_chunks_uploaded, resume_state, chunk_number_limit)
+
     if "PreviousRunId" in document:
         print("Reprocessing previous run", document["PreviousRunId"])
-        for page_chunks_file in list(run_directory_path.glob("page_text_chunks_*.txt")):
-            page_number = page_chunks_file.name.split("_")[3].split('.')[0]
+        page_chunks_files = [(int(f.name.split("_")[3].split('.')[0]), f) for f in run_directory_path.glob("page_text_chunks_*.txt")]
+        # glob doesn't return the files in page order
+        page_chunks_files.sort(key=lambda p: p[0])
+        for (page_number, page_chunks_file) in page_chunks_files:
+            if page_number < start_page:
+                continue
+
             with page_chunks_file.open() as f:
                 page_chunks = f.read()
             chunks = json.loads(page_chunks)
@@ -153,90 +849,22 @@ def index_using_pdf_to_image(document, chunk_size, spooling_size, cosmos_contain
                 print(f"QUALITY CONTROL!!!!")
                 print(f"Only {len(chunks)} Chunks Found. Chunks: {chunks}")
 
-            for text_chunk in chunks:
-                cleaned_up_text = text_chunk.strip()
-                # we don't want to index empty strings
-                if len(cleaned_up_text) == 0:
-                    continue
-
-                text_accumulator.append(f'<Chunk><DocumentName>{document["Name"]}</DocumentName><DocumentDescription>{document["Description"]}</DocumentDescription><Page>{page_number}</Page><Text>{cleaned_up_text}</Text></Chunk>')
-                if len(text_accumulator) > chunk_size:
-                    chunk_accumulator.append(text_accumulator)
-                    total_chunks+=1
-                    text_accumulator = []
-                
-                if len(chunk_accumulator) == spooling_size:
-                    overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, True, total_chunks, total_chunks_uploaded, '')
-                    total_chunks_uploaded+=(len(chunk_accumulator)-1)
-                    chunk_accumulator = chunk_accumulator[(spooling_size-1):]
+            spool_page_chunks(spool_state, document, page_number, chunks, chunk_size, spooling_size, upload_spool)
     else:
         print(f'Converting pages to image here: {raw_directory_path}')
-        images = convert_from_path(document["Location"], output_folder=raw_directory_path)
-        print(f"Created {len(images)} image pages")
-        for i, page_image in enumerate(images):
-            print(f"Processing page {i+1}")
-            page_image.save(run_directory_path.joinpath(f"page_{i+1}.png"), "PNG")
-            text = pytesseract.image_to_string(page_image)
-            with open(run_directory_path.joinpath(f"page_text_raw_{i+1}.txt"), "w") as w:
-                w.write(text) 
-
-            normalized_text = normalize_text(text)
-
-            with open(run_directory_path.joinpath(f"page_text_normalized_{i+1}.txt"), "w") as w:
-                w.write(normalized_text) 
-
-            normalized_text = normalized_text.strip()
-            if len(normalized_text) <= 3:
-                print(f"Skipping page, there is probably nothing of value to index. Text: '{normalized_text}'")
-                continue
-
-            chunks = chunk_text(normalized_text, openai_client)
-            
-            with open(run_directory_path.joinpath(f"page_text_chunks_{i+1}.txt"), "w") as w:
-                w.write(json.dumps(chunks)) 
-                
-            if len(chunks) <= 3:
-                print(f"QUALITY CONTROL!!!!")
-                print(f"Only {len(chunks)} Chunks Found. Chunks: {chunks}")
-
-            if len(chunks) == 0 and len(normalized_text) >= 20:
-                print("0 chunks found but normalized text isn't tiny.  Trying again")
-                chunks = chunk_text(normalized_text, openai_client)
-                
-                with open(run_directory_path.joinpath(f"page_text_chunks_{i+1}.txt"), "w") as w:
-                    w.write(json.dumps(chunks)) 
-                    
-                if len(chunks) == 0:
-                    print(f"QUALITY CONTROL!!!!")
-                    print(f"Still Only 0 Chunks Found. Chunks: {chunks}")
-                    print(f"Taking entire page")
-                    # just take the whole page if we really can't chunk it up for some reason
-                    chunks.append(normalized_text)
-            
-            for text_chunk in chunks:
-                cleaned_up_text = text_chunk.strip()
-                # we don't want to index empty strings
-                if len(cleaned_up_text) == 0:
-                    continue
-
-                text_accumulator.append(f'<Chunk><DocumentName>{document["Name"]}</DocumentName><DocumentDescription>{document["Description"]}</DocumentDescription><Page>{i+1}</Page><Text>{cleaned_up_text}</Text></Chunk>')
-                if len(text_accumulator) > chunk_size:
-                    chunk_accumulator.append(text_accumulator)
-                    total_chunks+=1
-                    text_accumulator = []
-                
-                if len(chunk_accumulator) == spooling_size:
-                    overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, True, total_chunks, total_chunks_uploaded, '')
-                    total_chunks_uploaded+=(len(chunk_accumulator)-1)
-                    chunk_accumulator = chunk_accumulator[(spooling_size-1):]
+        ocr_executor = get_ocr_executor()
+        try:
+            document_artifacts = get_document_artifacts(document, get_ocr_settings())
+            pages = prepare_ocr_pages(document["Location"], run_directory_path, raw_directory_path, ocr_executor, document_artifacts, start_page)
+            for (i, normalized_text, chunks) in chunk_pages(pages, openai_client, document_artifacts):
+                save_page_chunks(run_directory_path, i+1, chunks)
+                check_page_chunks(chunks, normalized_text)
+                spool_page_chunks(spool_state, document, i+1, chunks, chunk_size, spooling_size, upload_spool)
+        finally:
+            if ocr_executor is not None:
+                ocr_executor.shutdown()
         
-    if len(text_accumulator) != 0:
-        chunk_accumulator.append(text_accumulator)
-        total_chunks+=1
-        text_accumulator = []
-    
-    overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, False, total_chunks, total_chunks_uploaded, '')
-    total_chunks_uploaded+=len(chunk_accumulator)
+    flush_spool(spool_state, document, upload_spool)
 
     if get_config("CleanupTempData"):
         try:
@@ -244,72 +872,392 @@ def index_using_pdf_to_image(document, chunk_size, spooling_size, cosmos_contain
         except Exception as e:
             print(f"Failed to delete run directory {run_directory_path}.  Error: {e}")
     
-    return (total_chunks, total_chunks_uploaded)
+    return (spool_state["totalChunks"], spool_state["totalChunksUploaded"])
 
-def index_using_pdfplumber(document, chunk_size, spooling_size, cosmos_container, overlap_size, openai_client, total_chunks, total_chunks_uploaded):
-    chunk_accumulator = []
-    text_accumulator = []
+def extract_pdfplumber_pages(pdf, start_page = 1):
+    for i, page in enumerate(pdf.pages):
+        if i+1 < start_page:
+            continue
 
-    with pdfplumber.open(document["Location"]) as pdf:
-        print(f"Found {len(pdf.pages)} pages to index")
-        for i, page in enumerate(pdf.pages):
-            print(f"Processing {i+1} page")
+        print(f"Processing {i+1} page")
 
+        with get_run_metrics().time("extract", items=1) as counters:
             page_text = page.extract_text()
             page.flush_cache()
-            
-            chunks = chunk_text(page_text, openai_client)
-            if len(chunks) <= 3:
-                print(f"QUALITY CONTROL!!!!")
-                print(f"Only {len(chunks)} Chunks Found. Chunks: {chunks}")
+            counters["bytes"] = len((page_text or "").encode("utf-8"))
+        yield (i, page_text)
 
-            if len(chunks) == 0 and len(page_text) >= 20:
-                print("0 chunks found but normalized text isn't tiny.  Trying again")
-                chunks = chunk_text(page_text, openai_client)
-                    
-                if len(chunks) == 0:
-                    print(f"QUALITY CONTROL!!!!")
-                    print(f"Still Only {len(chunks)} Chunks Found. Chunks: {chunks}")
-                    print(f"Taking entire page")
-                    # just take the whole page if we really can't chunk it up for some reason
-                    chunks.append(page_text)
-            
-            for text in chunks:
-                cleaned_up_text = text.strip()
-                # we don't want to index empty strings
-                if len(cleaned_up_text) == 0:
-                    continue
+def extract_document_pages(pdf, document_location, start_page = 1):
+    # yields (page index, page text) in page order, from worker processes when PdfplumberWorkers allows it
+    extraction_workers = get_worker_count("PdfplumberWorkers", 1)
+    if extraction_workers > 1:
+        return extract_pdfplumber_pages_in_parallel(document_location, len(pdf.pages), start_page, extraction_workers)
 
-                text_accumulator.append(f'<Chunk><DocumentName>{document["Name"]}</DocumentName><DocumentDescription>{document["Description"]}</DocumentDescription><Page>{i+1}</Page><Text>{cleaned_up_text}</Text></Chunk>')
-                if len(text_accumulator) > chunk_size:
-                    chunk_accumulator.append(text_accumulator)
-                    total_chunks+=1
-                    text_accumulator = []
-                
-                if len(chunk_accumulator) == spooling_size:
-                    overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, True, total_chunks, total_chunks_uploaded, '')
-                    total_chunks_uploaded+=(len(chunk_accumulator)-1)
-                    chunk_accumulator = chunk_accumulator[(spooling_size-1):]
-        
-        if len(text_accumulator) != 0:
-            chunk_accumulator.append(text_accumulator)
-            total_chunks+=1
-            text_accumulator = []
+    return extract_pdfplumber_pages(pdf, start_page)
+
+def extract_pdfplumber_page_range(document_location, first_page, last_page):
+    # runs in a worker process, each one opens its own copy of the document since pdfplumber objects can't be pickled
+    page_texts = []
+    with pdfplumber.open(document_location) as pdf:
+        for page in pdf.pages[first_page - 1:last_page]:
+            page_texts.append(page.extract_text())
+            page.flush_cache()
+    return page_texts
+
+def extract_pdfplumber_pages_in_parallel(document_location, page_count, start_page, extraction_workers):
+    # layout analysis is pure python and CPU bound so threads don't help, split the document into page ranges across processes instead.
+    # the ranges are kept small so the first pages come back quickly and a slow range doesn't leave the other workers idle
+    pages_per_task = get_config("PdfplumberPagesPerTask")
+    pages_per_task = int(pages_per_task) if pages_per_task else 25
+    page_ranges = [(first_page, min(first_page + pages_per_task - 1, page_count)) for first_page in range(start_page, page_count + 1, pages_per_task)]
+    print(f"Extracting {len(page_ranges)} page ranges with {extraction_workers} workers")
+
+    with ProcessPoolExecutor(max_workers=extraction_workers) as executor:
+        # map hands the ranges back in submission order so the pages come out in page order
+        range_texts = executor.map(extract_pdfplumber_page_range, [document_location] * len(page_ranges), [r[0] for r in page_ranges], [r[1] for r in page_ranges])
+        for (first_page, _) in page_ranges:
+            # this is the time spent waiting on the workers rather than the extraction itself
+            with get_run_metrics().time("extract") as counters:
+                page_texts = next(range_texts)
+                counters["items"] = len(page_texts)
+                counters["bytes"] = sum(len((page_text or "").encode("utf-8")) for page_text in page_texts)
+
+            for j, page_text in enumerate(page_texts):
+                print(f"Processing {first_page + j} page")
+                yield (first_page + j - 1, page_text)
+
+def index_using_pdfplumber(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal = None, resume_state = None, chunk_number_limit = None):
+    upload_spool = get_spool_uploader(vector_store, overlap_size, openai_client, checkpoint_journal)
+    (spool_state, start_page) = resume_spool(document, chunk_size, spooling_size, upload_spool, total_chunks, total_chunks_uploaded, resume_state, chunk_number_limit)
+
+    with pdfplumber.open(document["Location"]) as pdf:
+        print(f"Found {len(pdf.pages)} pages to index")
+        document_artifacts = get_document_artifacts(document, { "extractor": "pdfplumber" })
+        pages = extract_document_pages(pdf, document["Location"], start_page)
+
+        for (i, page_text, chunks) in chunk_pages(pages, openai_client, document_artifacts):
+            check_page_chunks(chunks, page_text)
+            spool_page_chunks(spool_state, document, i+1, chunks, chunk_size, spooling_size, upload_spool)
         
-        overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, False, total_chunks, total_chunks_uploaded, '')
+        flush_spool(spool_state, document, upload_spool)
 
-    return (total_chunks, total_chunks_uploaded)
+    return (spool_state["totalChunks"], spool_state["totalChunksUploaded"])
             
-def upload_final_ruling():
+def get_worker_count(key: str, default: int):
+    workers = get_config(key)
+    return int(workers) if workers else default
+
+def index_using_pipeline(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal = None, resume_state = None, chunk_number_limit = None):
+    # same chunks and ids as index_using_pdf_to_image/index_using_pdfplumber, but every stage runs on its own workers
+    # with a bounded queue in between so OCR on the CPU overlaps with chunking, embedding and upserts on the network
+    use_ocr = bool(get_config("ConvertToImagesFirst"))
+    use_text_layer = use_ocr and bool(get_config("UseTextLayerWhenUsable"))
+
+    run_directory_path = Path(get_config("TempImageLocation")).joinpath(str(uuid.uuid4()))
+    raw_directory_path = run_directory_path.joinpath("raw")
+    if use_ocr:
+        raw_directory_path.mkdir(exist_ok=True, parents=True)
+        print(f'Converting pages to image here: {raw_directory_path}')
+
+    upload_spool = get_spool_uploader(vector_store, overlap_size, openai_client, checkpoint_journal)
+    (spool_state, start_page) = resume_spool(document, chunk_size, spooling_size, upload_spool, total_chunks, total_chunks_uploaded, resume_state, chunk_number_limit)
+
+    document_artifacts = get_document_artifacts(document, get_ocr_settings() if use_ocr else { "extractor": "pdfplumber" })
+    with pdfplumber.open(document["Location"]) as pdf:
+        page_count = len(pdf.pages)
+    print(f"Found {page_count} pages to index")
+
+    # pdfplumber documents can't be shared between threads so every render worker opens its own
+    thread_state = threading.local()
+    open_pdfs = []
+    open_pdfs_lock = threading.Lock()
+    def get_thread_pdf():
+        if not hasattr(thread_state, "pdf"):
+            thread_state.pdf = pdfplumber.open(document["Location"])
+            with open_pdfs_lock:
+                open_pdfs.append(thread_state.pdf)
+        return thread_state.pdf
+
+    # rendered pages sit in memory until they're OCR'd so only a render window's worth of them are let through at once.
+    # like render_and_ocr_pages the window is only sized once some page actually needs rendering
+    render_slots = None
+    render_slots_lock = threading.Lock()
+    def acquire_render_slot(page_number):
+        nonlocal render_slots
+        with render_slots_lock:
+            if render_slots is None:
+                render_slots = threading.Semaphore(get_render_window_size(document["Location"], page_number))
+        while not render_slots.acquire(timeout=0.5):
+            if pipeline.is_aborted():
+                raise PipelineAborted()
+
+    def render_page(page_number):
+        # yields (page number, image or None, text or None), the image is only rendered when there's no text to use
+        (known_text, _) = get_known_page_text(page_number, document_artifacts, get_thread_pdf() if use_text_layer else None)
+        if known_text is not None:
+            return [(page_number, None, known_text)]
+
+        acquire_render_slot(page_number)
+        try:
+            with get_run_metrics().time("render", items=1):
+                page_image = convert_from_path(document["Location"], first_page=page_number, last_page=page_number, **get_render_options(raw_directory_path))[0]
+        except:
+            render_slots.release()
+            raise
+        return [(page_number, page_image, None)]
+
+    def ocr_page(rendered_page):
+        (page_number, page_image, text) = rendered_page
+        print(f"Processing page {page_number}")
+        try:
+            if page_image is not None:
+                # the stage's threads hand the pages to the OCR worker processes, which keep tesseract to a single core each
+                with get_run_metrics().time("ocr", items=1) as counters:
+                    text = ocr_executor.submit(ocr_image, page_image).result() if ocr_executor is not None else ocr_image(page_image)
+                    counters["bytes"] = len(text.encode("utf-8"))
+                if document_artifacts is not None:
+                    document_artifacts.put_raw_text(page_number, text)
+
+            normalized_text = save_ocr_page(run_directory_path, page_number, page_image, text)
+        finally:
+            if page_image is not None:
+                page_image.close()
+                render_slots.release()
+
+        return [(page_number, normalized_text)] if normalized_text is not None else []
+
+    def chunk_extracted_page(extracted_page):
+        (page_number, text) = extracted_page
+        chunks = get_cached_chunks(page_number, document_artifacts)
+        if chunks is None:
+            chunks = chunk_page(text, openai_client)
+            cache_chunks(page_number, chunks, document_artifacts)
+
+        if use_ocr:
+            save_page_chunks(run_directory_path, page_number, chunks)
+
+        return [(page_number, check_page_chunks(chunks, text))]
+
+    # the spool stage sees pages in order and hands each spooled set of chunks on instead of uploading it itself
+    def spool_page(chunked_page):
+        (page_number, chunks) = chunked_page
+        uploads = []
+        spool_page_chunks(spool_state, document, page_number, chunks, chunk_size, spooling_size, lambda *upload: uploads.append(upload))
+        return uploads
+
+    def finish_spool():
+        uploads = []
+        flush_spool(spool_state, document, lambda *upload: uploads.append(upload))
+        return uploads
+
+    def embed_upload(upload):
+        (chunk_accumulator, ignore_last_index, upload_total_chunks, total_already_uploaded, checkpoint, first_chunk_number) = upload
+        return [(embed_chunks(openai_client, chunk_accumulator, overlap_size, ignore_last_index, upload_total_chunks, total_already_uploaded, first_chunk_number), checkpoint)]
+
+    # upserts run in spool order so a checkpoint is only ever written once everything before it is stored
+    def upsert_upload(embedded_upload):
+        (items, checkpoint) = embedded_upload
+        create_documents(vector_store, items)
+        if checkpoint_journal is not None and checkpoint is not None:
+            checkpoint_journal.record_progress(*checkpoint)
+        return []
+
+    ocr_executor = None
+    text_layer_pdf = None
+    if use_ocr:
+        ocr_executor = get_ocr_executor()
+        stages = [
+            PipelineStage("render", render_page, get_worker_count("RenderWorkers", 2)),
+            PipelineStage("ocr", ocr_page, get_worker_count("OcrWorkers", 1))
+        ]
+        source = range(start_page, page_count + 1)
+    else:
+        # extraction is the pipeline's source, so it already runs alongside the other stages and splits across
+        # worker processes the same way index_using_pdfplumber does
+        stages = []
+        text_layer_pdf = pdfplumber.open(document["Location"])
+        source = ((i + 1, page_text) for (i, page_text) in extract_document_pages(text_layer_pdf, document["Location"], start_page))
+
+    stages.extend([
+        PipelineStage("chunk", chunk_extracted_page, get_worker_count("MaxConcurrentChunking", 1)),
+        PipelineStage("spool", spool_page, ordered=True, on_finish=finish_spool),
+        PipelineStage("embed", embed_upload, get_worker_count("EmbeddingWorkers", 4)),
+        PipelineStage("upsert", upsert_upload, ordered=True)
+    ])
+
+    pipeline = Pipeline(stages, get_worker_count("PipelineQueueSize", 16))
+    try:
+        report = pipeline.run(source)
+    finally:
+        for pdf in open_pdfs:
+            pdf.close()
+        if text_layer_pdf is not None:
+            text_layer_pdf.close()
+        if ocr_executor is not None:
+            ocr_executor.shutdown()
+
+    print(f"Pipeline report: {json.dumps(report, indent=4)}")
+    get_run_metrics().append("pipelines", { "document": document["Name"], **report })
+
+    if use_ocr and get_config("CleanupTempData"):
+        try:
+            run_directory_path.unlink() # delete run directory
+        except Exception as e:
+            print(f"Failed to delete run directory {run_directory_path}.  Error: {e}")
+
+    return (spool_state["totalChunks"], spool_state["totalChunksUploaded"])
+
+def get_manifest_id(partition_key: str):
+    return f"IndexManifest_{partition_key}"
+
+def load_index_manifest(vector_store: VectorStore, partition_key: str, starting_chunk_number: int):
+    # the manifest lives in the Default partition next to SupportedRegulations so it never shows up in a vector search
+    manifest = vector_store.read_item(get_manifest_id(partition_key), "Default")
+    if manifest is None:
+        print(f"No index manifest found for {partition_key}, indexing every document")
+        return {
+            "id": get_manifest_id(partition_key),
+            "partitionKey": "Default",
+            "documentType": "IndexManifest",
+            "indexPartitionKey": partition_key,
+            "nextChunkNumber": starting_chunk_number,
+            "documents": {}
+        }
+
+    return manifest
+
+def forget_deleted_chunks(vector_store: VectorStore, partition_key: str, starting_at: int):
+    # a manifest still pointing at deleted chunks would make the next incremental run skip documents that aren't indexed anymore
+    manifest = vector_store.read_item(get_manifest_id(partition_key), "Default")
+    if manifest is None:
+        return
+
+    if starting_at == 0:
+        print(f"Deleting the index manifest for {partition_key}")
+        vector_store.delete_items([get_manifest_id(partition_key)], "Default")
+        return
+
+    for (document_name, entry) in manifest["documents"].items():
+        if entry["firstChunkNumber"] + entry["chunkCount"] > starting_at and entry["contentHash"] is not None:
+            # clearing the hash gets the document indexed again, which also deletes whatever is left of its old range
+            print(f"'{document_name}' lost some of its chunks and will be indexed again")
+            entry["contentHash"] = None
+    vector_store.upsert_item(manifest)
+
+def get_indexing_settings_hash():
+    # changing how chunks are built changes every chunk, so it has to invalidate every document
+    return hash_settings({
+        "chunkSize": get_config("ChunkSize"),
+        "overlap": get_config("Overlap"),
+        "storeChunkNeighbors": bool(get_config("StoreChunkNeighbors")),
+        "convertToImagesFirst": bool(get_config("ConvertToImagesFirst")),
+        "chunking": get_chunking_settings()
+    })
+
+def record_indexed_document(vector_store: VectorStore, manifest, document, content_hash: str, settings_hash: str, first_chunk_number: int, next_chunk_number: int):
+    partition_key = manifest["indexPartitionKey"]
+    previous_entry = manifest["documents"].get(document["Name"])
+    if previous_entry is not None:
+        # the new chunks were written to a fresh id range so the old range is entirely stale
+        stale_ids = [f"FinalRuling_{n}" for n in range(previous_entry["firstChunkNumber"], previous_entry["firstChunkNumber"] + previous_entry["chunkCount"])]
+        print(f"Deleting {len(stale_ids)} stale chunks for '{document['Name']}'")
+        vector_store.delete_items(stale_ids, partition_key)
+
+    manifest["documents"][document["Name"]] = {
+        "location": document["Location"],
+        "contentHash": content_hash,
+        "settingsHash": settings_hash,
+        "firstChunkNumber": first_chunk_number,
+        "chunkCount": next_chunk_number - first_chunk_number
+    }
+    # documents indexed in parallel finish in any order, so never move this backwards
+    manifest["nextChunkNumber"] = max(manifest["nextChunkNumber"], next_chunk_number)
+    vector_store.upsert_item(manifest)
+
+def get_checkpoint_journal(partition_key: str, resume: bool):
+    journal_location = get_config("CheckpointJournalLocation")
+    if not journal_location:
+        if resume:
+            print("CheckpointJournalLocation isn't configured, there is nothing to resume from")
+        return None
+
+    return CheckpointJournal(str(Path(journal_location).joinpath(f"{partition_key}.jsonl")), resume)
+
+def index_document(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal = None, resume_state = None, chunk_number_limit = None):
+    start = time.perf_counter()
+    if get_config("UsePipelinedIndexing") and "PreviousRunId" not in document:
+        result = index_using_pipeline(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal, resume_state, chunk_number_limit)
+    elif get_config("ConvertToImagesFirst"):
+        result = index_using_pdf_to_image(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal, resume_state, chunk_number_limit)
+    else:
+        result = index_using_pdfplumber(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal, resume_state, chunk_number_limit)
+
+    seconds = time.perf_counter() - start
+    get_run_metrics().record("document", calls=1, items=1, seconds=seconds)
+    get_run_metrics().append("documents", {
+        "document": document["Name"],
+        "seconds": round(seconds, 2),
+        "totalChunksUploaded": result[1]
+    })
+    return result
+
+def index_documents_in_parallel(documents_to_index, chunk_size, spooling_size, vector_store, overlap_size, openai_client, first_free_chunk_number, manifest, settings_hash, checkpoint_journal, max_concurrent_documents):
+    chunk_id_range_size = get_config("ChunkIdRangeSize")
+    chunk_id_range_size = int(chunk_id_range_size) if chunk_id_range_size else 100000
+
+    # every document gets its own block of ids up front so a chunk's id doesn't depend on which document finishes first,
+    # blocks handed out by an interrupted run are still in use so new ones start past all of them
+    journal_entries = checkpoint_journal.get_document_entries() if checkpoint_journal is not None else []
+    next_range_start = max([first_free_chunk_number] + [entry["firstChunkNumber"] + chunk_id_range_size for entry in journal_entries])
+    assignments = []
+    for (document, content_hash, journal_entry) in documents_to_index:
+        if journal_entry is not None:
+            first_chunk_number = journal_entry["firstChunkNumber"]
+        else:
+            first_chunk_number = next_range_start
+            next_range_start += chunk_id_range_size
+        assignments.append((document, content_hash, journal_entry, first_chunk_number))
+
+    manifest_lock = threading.Lock()
+    def index_assigned_document(document, content_hash, journal_entry, first_chunk_number):
+        resume_state = journal_entry if journal_entry is not None and journal_entry["status"] == "inProgress" else None
+        if checkpoint_journal is not None:
+            if resume_state is not None:
+                checkpoint_journal.continue_document(document["Name"], first_chunk_number)
+            else:
+                checkpoint_journal.start_document(document["Name"], first_chunk_number, first_chunk_number, first_chunk_number)
+
+        (total_chunks, next_chunk_number) = index_document(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, first_chunk_number, first_chunk_number, checkpoint_journal, resume_state, first_chunk_number + chunk_id_range_size)
+
+        if manifest is not None:
+            with manifest_lock:
+                record_indexed_document(vector_store, manifest, document, content_hash, settings_hash, first_chunk_number, next_chunk_number)
+
+        if checkpoint_journal is not None:
+            checkpoint_journal.complete_document(document["Name"], total_chunks, next_chunk_number)
+
+        print(f"Finished '{document['Name']}' using chunk ids {first_chunk_number} to {next_chunk_number - 1}")
+
+    # the shared clients and caches are created before any threads start so every document ends up using the same ones
+    get_embedding_cache()
+    get_openai_throttle("Chat")
+    get_openai_throttle("Embeddings")
+
+    print(f"Indexing {len(assignments)} document(s), {max_concurrent_documents} at a time")
+    with ThreadPoolExecutor(max_workers=max_concurrent_documents) as executor:
+        futures = [executor.submit(index_assigned_document, *assignment) for assignment in assignments]
+
+    # every other document still gets to finish before the first failure is raised
+    for future in futures:
+        future.result()
+
+def upload_final_ruling(resume: bool = False):
     print('Uploading Final Ruling')
 
-    openai_client = AzureOpenAI(
-        api_key = get_config("AZURE_OPENAI_API_KEY"),
-        api_version = "2024-02-01",
-        azure_endpoint = get_config("AZURE_OPENAI_ENDPOINT")
-    )
+    openai_client = get_openai_client()
 
-    cosmos_container = get_cosmos_container()
+    vector_store = get_vector_store()
+    start_run_metrics(vector_store)
 
     chunk_size = get_config("ChunkSize")
     overlap_size = get_config("Overlap")
@@ -326,18 +1274,73 @@ def upload_final_ruling():
     total_chunks = 0
     total_chunks_uploaded = get_config("StartingChunkCount") if get_config("StartingChunkCount") is not None else 0 
 
+    manifest = None
+    settings_hash = None
+    if get_config("IncrementalIndexing"):
+        manifest = load_index_manifest(vector_store, partition_key, total_chunks_uploaded)
+        # changed documents get a brand new id range past everything that has ever been indexed
+        total_chunks_uploaded = max(total_chunks_uploaded, manifest["nextChunkNumber"])
+        settings_hash = get_indexing_settings_hash()
+
+    checkpoint_journal = get_checkpoint_journal(partition_key, resume)
+    resume_totals = checkpoint_journal.get_resume_totals() if checkpoint_journal is not None else None
+    if resume_totals is not None:
+        total_chunks = resume_totals[0]
+        total_chunks_uploaded = max(total_chunks_uploaded, resume_totals[1])
+        print(f"Resuming with {total_chunks_uploaded} chunks already uploaded")
+
+    max_concurrent_documents = get_config("MaxConcurrentDocuments")
+    max_concurrent_documents = int(max_concurrent_documents) if max_concurrent_documents else 1
+    documents_to_index = []
+
     for document in documents:   
         print(f"Processing '{document['Name']}'")
-        if get_config("ConvertToImagesFirst"):
-            (final_total_chunks, final_total_chunks_uploaded) = index_using_pdf_to_image(document, chunk_size, spooling_size, cosmos_container, overlap_size, openai_client, total_chunks, total_chunks_uploaded)
-            total_chunks = final_total_chunks
-            total_chunks_uploaded = final_total_chunks_uploaded
-        else:
-            (final_total_chunks, final_total_chunks_uploaded) = index_using_pdfplumber(document, chunk_size, spooling_size, cosmos_container, overlap_size, openai_client, total_chunks, total_chunks_uploaded)
-            total_chunks = final_total_chunks
-            total_chunks_uploaded = final_total_chunks_uploaded
+        journal_entry = checkpoint_journal.get_document_entry(document["Name"]) if checkpoint_journal is not None else None
+        if journal_entry is not None and journal_entry["status"] == "complete":
+            print(f"'{document['Name']}' finished before the previous run stopped, skipping")
+            continue
+        resume_state = journal_entry if journal_entry is not None and journal_entry["status"] == "inProgress" else None
+
+        content_hash = None
+        if manifest is not None:
+            content_hash = hash_file(document["Location"])
+            previous_entry = manifest["documents"].get(document["Name"])
+            if previous_entry is not None and previous_entry["contentHash"] == content_hash and previous_entry["settingsHash"] == settings_hash:
+                print(f"'{document['Name']}' hasn't changed since it was last indexed, skipping")
+                continue
+
+        if max_concurrent_documents > 1:
+            documents_to_index.append((document, content_hash, journal_entry))
+            continue
+
+        first_chunk_number = resume_state["firstChunkNumber"] if resume_state is not None else total_chunks_uploaded
+        if checkpoint_journal is not None:
+            if resume_state is not None:
+                checkpoint_journal.continue_document(document["Name"], first_chunk_number)
+            else:
+                checkpoint_journal.start_document(document["Name"], first_chunk_number, total_chunks, total_chunks_uploaded)
+
+        (final_total_chunks, final_total_chunks_uploaded) = index_document(document, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks, total_chunks_uploaded, checkpoint_journal, resume_state)
+        total_chunks = final_total_chunks
+        total_chunks_uploaded = final_total_chunks_uploaded
+
+        if manifest is not None:
+            record_indexed_document(vector_store, manifest, document, content_hash, settings_hash, first_chunk_number, total_chunks_uploaded)
+
+        if checkpoint_journal is not None:
+            checkpoint_journal.complete_document(document["Name"], total_chunks, total_chunks_uploaded)
+
+    if len(documents_to_index) > 0:
+        index_documents_in_parallel(documents_to_index, chunk_size, spooling_size, vector_store, overlap_size, openai_client, total_chunks_uploaded, manifest, settings_hash, checkpoint_journal, max_concurrent_documents)
 
-def overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size, openai_client, ignore_last_index, total_chunks, total_already_uploaded, joining_character):
+    if checkpoint_journal is not None:
+        checkpoint_journal.close()
+
+    print_vector_store_report(vector_store)
+    print_openai_throttle_report()
+    finish_run_metrics("FinalRuling")
+
+def overlap_chunks(chunk_accumulator, overlap_size, ignore_last_index):
     overlapped_chunks = []
     if len(chunk_accumulator) > 1:
         for i, chunk in enumerate(chunk_accumulator):
@@ -371,18 +1374,77 @@ def overlap_and_upload_chunks(cosmos_container, chunk_accumulator, overlap_size,
         overlapped_chunks.append(chunk_accumulator[0])
 
     print(f"Overlapped chunks {len(overlapped_chunks)}")
-    for i, chunks in enumerate(overlapped_chunks):
-        chunked_data = joining_character.join(chunks)
+    return overlapped_chunks
 
-        embeddings = generate_embeddings(openai_client, chunked_data)
-        
-        partition_key = get_config("PartitionKey")
-        print(f"Saving chunk {i+1+total_already_uploaded} of {total_chunks}")
-        create_document(cosmos_container, chunked_data, embeddings, i+total_already_uploaded, partition_key, "FinalRuling")
+def embed_overlapped_chunks(openai_client, overlapped_chunks, total_chunks, total_already_uploaded, joining_character):
+    chunked_data_list = [joining_character.join(chunks) for chunks in overlapped_chunks]
+    chunk_embeddings = generate_embeddings_batch(openai_client, chunked_data_list)
+
+    partition_key = get_config("PartitionKey")
+    print(f"Saving chunks {total_already_uploaded+1} to {total_already_uploaded+len(chunked_data_list)} of {total_chunks}")
+    return [build_document(chunked_data, embeddings, i+total_already_uploaded, partition_key, "FinalRuling") for i, (chunked_data, embeddings) in enumerate(zip(chunked_data_list, chunk_embeddings))]
+
+def embed_neighbor_chunks(openai_client, chunk_accumulator, overlap_size, ignore_last_index, total_chunks, total_already_uploaded, first_chunk_number, joining_character):
+    # the overlap is only used to build the embedding input, each chunk is stored once with just its own text and
+    # the ids of the chunks around it so the API can pull the overlap back in when the chunk is retrieved
+    overlapped_chunks = overlap_chunks(chunk_accumulator, overlap_size, ignore_last_index)
+    chunk_embeddings = generate_embeddings_batch(openai_client, [joining_character.join(chunks) for chunks in overlapped_chunks])
+
+    partition_key = get_config("PartitionKey")
+    print(f"Saving chunks {total_already_uploaded+1} to {total_already_uploaded+len(overlapped_chunks)} of {total_chunks}")
+    items = []
+    for i, embeddings in enumerate(chunk_embeddings):
+        chunk_number = i + total_already_uploaded
+        item = build_document(joining_character.join(chunk_accumulator[i]), embeddings, chunk_number, partition_key, "FinalRuling")
+        item["sequence"] = chunk_number
+        # the API widens the chunk by the same number of sentences the embedding saw on each side, overlap_chunks only
+        # reaches back from chunks after the first of a spool and forward from chunks before its last
+        item["overlapBefore"] = int(overlap_size) if i > 0 else 0
+        item["overlapAfter"] = int(overlap_size) if i < len(chunk_accumulator) - 1 else 0
+        # the first chunk of a spool carries on from the last chunk of the previous spool unless it starts the document,
+        # and without a first chunk number (an older checkpoint) it's safer to leave the link out than point into another document
+        if i > 0 or (first_chunk_number is not None and chunk_number > first_chunk_number):
+            item["previousId"] = f"FinalRuling_{chunk_number - 1}"
+        # with ignore_last_index the last chunk is stored by the next spool, so every chunk here but the document's last has a next one
+        if i < len(chunk_accumulator) - 1:
+            item["nextId"] = f"FinalRuling_{chunk_number + 1}"
+        items.append(item)
+    return items
+
+def embed_chunks(openai_client, chunk_accumulator, overlap_size, ignore_last_index, total_chunks, total_already_uploaded, first_chunk_number):
+    if get_config("StoreChunkNeighbors"):
+        return embed_neighbor_chunks(openai_client, chunk_accumulator, overlap_size, ignore_last_index, total_chunks, total_already_uploaded, first_chunk_number, '')
+
+    overlapped_chunks = overlap_chunks(chunk_accumulator, overlap_size, ignore_last_index)
+    return embed_overlapped_chunks(openai_client, overlapped_chunks, total_chunks, total_already_uploaded, '')
+
+def print_artifact_cache_summary():
+    artifact_cache = get_artifact_cache()
+    if artifact_cache is None:
+        print("ArtifactCacheLocation isn't configured")
+        return
+
+    summary = artifact_cache.get_summary()
+    print(f"Found {len(summary)} cached document(s)")
+    for document in summary:
+        print(json.dumps(document, indent=4))
+
+def prune_artifact_cache(document_hash: str, older_than_days: float):
+    artifact_cache = get_artifact_cache()
+    if artifact_cache is None:
+        print("ArtifactCacheLocation isn't configured")
+        return
+
+    if not document_hash and older_than_days is None:
+        print("Provide a document hash (-x) and/or a number of days (-a) to prune")
+        return
+
+    removed = artifact_cache.prune(document_hash, older_than_days)
+    print(f"Pruned {removed} cached page artifacts")
 
 def main():
     try:
-        opts, _ = getopt.getopt(sys.argv[1:], "rfdt:i:", ['upload-final-ruling', 'upload-fact-sheet', 'delete-document-type', 'document-type', 'starting-at'])
+        opts, _ = getopt.getopt(sys.argv[1:], "rfdt:i:cpx:a:", ['upload-final-ruling', 'upload-fact-sheet', 'delete-document-type', 'document-type', 'starting-at', 'cache-info', 'prune-cache', 'document-hash', 'older-than-days', 'resume'])
     except getopt.GetoptError:
         print_help()
         sys.exit(2)
@@ -393,7 +1455,7 @@ def main():
     
     upload_ruling = get_flag(opts, '-r')
     if upload_ruling:
-        upload_final_ruling()
+        upload_final_ruling(get_flag(opts, '--resume'))
 
     upload_fact = get_flag(opts, '-f')
     if upload_fact:
@@ -406,6 +1468,17 @@ def main():
         parsed_starting_at = int(starting_at) if starting_at else 0 
         delete_document_type(document_type, parsed_starting_at)
 
+    cache_info = get_flag(opts, '-c')
+    if cache_info:
+        print_artifact_cache_summary()
+
+    prune_cache = get_flag(opts, '-p')
+    if prune_cache:
+        document_hash = get_value(opts, '-x')
+        older_than_days = get_value(opts, '-a')
+        parsed_older_than_days = float(older_than_days) if older_than_days else None
+        prune_artifact_cache(document_hash, parsed_older_than_days)
+
 def requesting_help(opts):
     help = next((o for o in opts if len(o) > 0 and o[0] == '-h'), None)
     return help != None
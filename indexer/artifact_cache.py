@@ -0,0 +1,176 @@
+import sqlite3
+import hashlib
+import threading
+import time
+import json
+from pathlib import Path
+
+def hash_file(location: str):
+    file_hash = hashlib.sha256()
+    with open(location, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+def hash_settings(settings: dict):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+class ArtifactCache:
+    def __init__(self, location: str):
+        Path(location).parent.mkdir(exist_ok=True, parents=True)
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(location, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS documents (
+                documentHash TEXT PRIMARY KEY,
+                location TEXT NOT NULL,
+                name TEXT NOT NULL,
+                lastUsed REAL NOT NULL
+            )
+        """)
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS pageText (
+                documentHash TEXT NOT NULL,
+                pageNumber INTEGER NOT NULL,
+                ocrSettings TEXT NOT NULL,
+                rawText TEXT NOT NULL,
+                lastUsed REAL NOT NULL,
+                PRIMARY KEY (documentHash, pageNumber, ocrSettings)
+            )
+        """)
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS pageChunks (
+                documentHash TEXT NOT NULL,
+                pageNumber INTEGER NOT NULL,
+                ocrSettings TEXT NOT NULL,
+                chunkingSettings TEXT NOT NULL,
+                chunks TEXT NOT NULL,
+                lastUsed REAL NOT NULL,
+                PRIMARY KEY (documentHash, pageNumber, ocrSettings, chunkingSettings)
+            )
+        """)
+        self.__connection.commit()
+
+    def for_document(self, document_location: str, document_name: str, ocr_settings: dict, chunking_settings: dict):
+        document_hash = hash_file(document_location)
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO documents (documentHash, location, name, lastUsed) VALUES (?, ?, ?, ?)",
+                (document_hash, document_location, document_name, time.time())
+            )
+            self.__connection.commit()
+
+        return DocumentArtifacts(self, document_hash, hash_settings(ocr_settings), hash_settings(chunking_settings))
+
+    def get_raw_text(self, document_hash: str, ocr_settings: str, page_number: int):
+        key = (document_hash, page_number, ocr_settings)
+        with self.__lock:
+            row = self.__connection.execute("SELECT rawText FROM pageText WHERE documentHash = ? AND pageNumber = ? AND ocrSettings = ?", key).fetchone()
+            if row is None:
+                return None
+
+            self.__connection.execute("UPDATE pageText SET lastUsed = ? WHERE documentHash = ? AND pageNumber = ? AND ocrSettings = ?", (time.time(), *key))
+            self.__connection.commit()
+            return row[0]
+
+    def put_raw_text(self, document_hash: str, ocr_settings: str, page_number: int, raw_text: str):
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO pageText (documentHash, pageNumber, ocrSettings, rawText, lastUsed) VALUES (?, ?, ?, ?, ?)",
+                (document_hash, page_number, ocr_settings, raw_text, time.time())
+            )
+            self.__connection.commit()
+
+    def get_chunks(self, document_hash: str, ocr_settings: str, chunking_settings: str, page_number: int):
+        key = (document_hash, page_number, ocr_settings, chunking_settings)
+        with self.__lock:
+            row = self.__connection.execute("SELECT chunks FROM pageChunks WHERE documentHash = ? AND pageNumber = ? AND ocrSettings = ? AND chunkingSettings = ?", key).fetchone()
+            if row is None:
+                return None
+
+            self.__connection.execute("UPDATE pageChunks SET lastUsed = ? WHERE documentHash = ? AND pageNumber = ? AND ocrSettings = ? AND chunkingSettings = ?", (time.time(), *key))
+            self.__connection.commit()
+            return json.loads(row[0])
+
+    def put_chunks(self, document_hash: str, ocr_settings: str, chunking_settings: str, page_number: int, chunks: list[str]):
+        with self.__lock:
+            self.__connection.execute(
+                "INSERT OR REPLACE INTO pageChunks (documentHash, pageNumber, ocrSettings, chunkingSettings, chunks, lastUsed) VALUES (?, ?, ?, ?, ?, ?)",
+                (document_hash, page_number, ocr_settings, chunking_settings, json.dumps(chunks), time.time())
+            )
+            self.__connection.commit()
+
+    def get_summary(self):
+        with self.__lock:
+            rows = self.__connection.execute("""
+                SELECT
+                    d.documentHash, d.name, d.location, d.lastUsed,
+                    (SELECT COUNT(*) FROM pageText t WHERE t.documentHash = d.documentHash) AS textPages,
+                    (SELECT COALESCE(SUM(LENGTH(t.rawText)), 0) FROM pageText t WHERE t.documentHash = d.documentHash) AS textSize,
+                    (SELECT COUNT(*) FROM pageChunks c WHERE c.documentHash = d.documentHash) AS chunkedPages,
+                    (SELECT COALESCE(SUM(LENGTH(c.chunks)), 0) FROM pageChunks c WHERE c.documentHash = d.documentHash) AS chunksSize
+                FROM documents d
+                ORDER BY d.lastUsed DESC
+            """).fetchall()
+
+        return [{
+            "documentHash": row[0],
+            "name": row[1],
+            "location": row[2],
+            "lastUsed": row[3],
+            "textPages": row[4],
+            "textSize": row[5],
+            "chunkedPages": row[6],
+            "chunksSize": row[7]
+        } for row in rows]
+
+    def prune(self, document_hash: str = None, older_than_days: float = None):
+        conditions = []
+        parameters = []
+        if document_hash:
+            conditions.append("documentHash = ?")
+            parameters.append(document_hash)
+        if older_than_days is not None:
+            conditions.append("lastUsed < ?")
+            parameters.append(time.time() - older_than_days * 24 * 60 * 60)
+
+        where = f"WHERE {' AND '.join(conditions)}" if len(conditions) > 0 else ""
+        with self.__lock:
+            removed = 0
+            for table in ["pageText", "pageChunks"]:
+                removed += self.__connection.execute(f"DELETE FROM {table} {where}", parameters).rowcount
+
+            # documents without any artifacts left are just noise in the summary
+            self.__connection.execute("""
+                DELETE FROM documents
+                WHERE documentHash NOT IN (SELECT documentHash FROM pageText)
+                AND documentHash NOT IN (SELECT documentHash FROM pageChunks)
+            """)
+            self.__connection.commit()
+            self.__connection.execute("VACUUM")
+
+        return removed
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
+
+class DocumentArtifacts:
+    def __init__(self, artifact_cache: ArtifactCache, document_hash: str, ocr_settings: str, chunking_settings: str):
+        self.__artifact_cache = artifact_cache
+        self.document_hash = document_hash
+        self.__ocr_settings = ocr_settings
+        self.__chunking_settings = chunking_settings
+
+    def get_raw_text(self, page_number: int):
+        return self.__artifact_cache.get_raw_text(self.document_hash, self.__ocr_settings, page_number)
+
+    def put_raw_text(self, page_number: int, raw_text: str):
+        self.__artifact_cache.put_raw_text(self.document_hash, self.__ocr_settings, page_number, raw_text)
+
+    def get_chunks(self, page_number: int):
+        return self.__artifact_cache.get_chunks(self.document_hash, self.__ocr_settings, self.__chunking_settings, page_number)
+
+    def put_chunks(self, page_number: int, chunks: list[str]):
+        self.__artifact_cache.put_chunks(self.document_hash, self.__ocr_settings, self.__chunking_settings, page_number, chunks)
@@ -0,0 +1,147 @@
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from azure.cosmos import ContainerProxy
+from azure.cosmos.exceptions import CosmosHttpResponseError, CosmosBatchOperationError, CosmosResourceNotFoundError
+
+# cosmos rejects transactional batches with more than 100 operations or a payload over 2MB
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 1800 * 1024
+
+class BulkWriter:
+    def __init__(self, cosmos_container: ContainerProxy, mode: str = "batch", max_concurrency: int = 8, max_retries: int = 10):
+        self.__cosmos_container = cosmos_container
+        self.__mode = mode
+        self.__max_concurrency = max_concurrency
+        self.__max_retries = max_retries
+        self.__lock = threading.Lock()
+
+        self.items_written = 0
+        self.items_deleted = 0
+        self.request_charge = 0.0
+        self.throttles = 0
+        self.elapsed_seconds = 0.0
+
+    def __record_charge(self, headers, _):
+        request_charge = float(headers.get("x-ms-request-charge", 0)) if headers else 0.0
+        with self.__lock:
+            self.request_charge += request_charge
+
+    def __execute_with_retry(self, operation):
+        attempt = 0
+        while True:
+            try:
+                return operation()
+            except (CosmosHttpResponseError, CosmosBatchOperationError) as e:
+                if getattr(e, "status_code", None) != 429 or attempt >= self.__max_retries:
+                    raise
+
+                headers = getattr(e, "headers", None) or {}
+                retry_after_ms = headers.get("x-ms-retry-after-ms")
+                delay = float(retry_after_ms) / 1000 if retry_after_ms else min(2 ** attempt, 30)
+                with self.__lock:
+                    self.throttles += 1
+                print(f"Throttled by Cosmos, retrying in {delay:.2f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    def __get_batches(self, items: list[dict]):
+        # transactional batches have to target a single partition
+        partitions = {}
+        for item in items:
+            partitions.setdefault(item["partitionKey"], []).append(item)
+
+        batches = []
+        for (partition_key, partition_items) in partitions.items():
+            batch = []
+            batch_bytes = 0
+            for item in partition_items:
+                item_bytes = len(json.dumps(item))
+                if len(batch) > 0 and (len(batch) >= MAX_BATCH_OPERATIONS or batch_bytes + item_bytes > MAX_BATCH_BYTES):
+                    batches.append((partition_key, batch))
+                    batch = []
+                    batch_bytes = 0
+                batch.append(item)
+                batch_bytes += item_bytes
+
+            if len(batch) > 0:
+                batches.append((partition_key, batch))
+
+        return batches
+
+    def __write_batch(self, partition_key: str, batch: list[dict]):
+        operations = [("upsert", (item,)) for item in batch]
+        self.__execute_with_retry(lambda: self.__cosmos_container.execute_item_batch(operations, partition_key=partition_key, response_hook=self.__record_charge))
+        return len(batch)
+
+    def __write_item(self, item: dict):
+        self.__execute_with_retry(lambda: self.__cosmos_container.upsert_item(item, response_hook=self.__record_charge))
+        return 1
+
+    def upsert_items(self, items: list[dict]):
+        if len(items) == 0:
+            return
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.__max_concurrency) as executor:
+            if self.__mode == "batch":
+                written = sum(executor.map(lambda b: self.__write_batch(*b), self.__get_batches(items)))
+            else:
+                written = sum(executor.map(self.__write_item, items))
+        elapsed_seconds = time.perf_counter() - start
+
+        with self.__lock:
+            self.items_written += written
+            self.elapsed_seconds += elapsed_seconds
+
+        print(f"Upserted {written} items in {elapsed_seconds:.2f}s")
+
+    def __delete_item(self, item_id: str, partition_key: str):
+        try:
+            self.__execute_with_retry(lambda: self.__cosmos_container.delete_item(item_id, partition_key=partition_key, response_hook=self.__record_charge))
+            return 1
+        except CosmosResourceNotFoundError:
+            # already gone is exactly what we wanted
+            return 0
+
+    def __delete_batch(self, item_ids: list[str], partition_key: str):
+        operations = [("delete", (item_id,)) for item_id in item_ids]
+        try:
+            self.__execute_with_retry(lambda: self.__cosmos_container.execute_item_batch(operations, partition_key=partition_key, response_hook=self.__record_charge))
+            return len(item_ids)
+        except CosmosBatchOperationError:
+            # a batch fails as a whole if any one of the items is already gone, so fall back to deleting them one at a time
+            return sum(self.__delete_item(item_id, partition_key) for item_id in item_ids)
+
+    def delete_items(self, item_ids: list[str], partition_key: str):
+        if len(item_ids) == 0:
+            return 0
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.__max_concurrency) as executor:
+            if self.__mode == "batch":
+                batches = [item_ids[i:i + MAX_BATCH_OPERATIONS] for i in range(0, len(item_ids), MAX_BATCH_OPERATIONS)]
+                deleted = sum(executor.map(lambda batch: self.__delete_batch(batch, partition_key), batches))
+            else:
+                deleted = sum(executor.map(lambda item_id: self.__delete_item(item_id, partition_key), item_ids))
+        elapsed_seconds = time.perf_counter() - start
+
+        with self.__lock:
+            self.items_deleted += deleted
+            self.elapsed_seconds += elapsed_seconds
+
+        print(f"Deleted {deleted} items in {elapsed_seconds:.2f}s")
+        return deleted
+
+    def get_report(self):
+        elapsed_seconds = self.elapsed_seconds if self.elapsed_seconds > 0 else 1
+        return {
+            "itemsWritten": self.items_written,
+            "itemsDeleted": self.items_deleted,
+            "requestCharge": round(self.request_charge, 2),
+            "throttles": self.throttles,
+            "elapsedSeconds": round(self.elapsed_seconds, 2),
+            "itemsPerSecond": round((self.items_written + self.items_deleted) / elapsed_seconds, 2),
+            "requestUnitsPerSecond": round(self.request_charge / elapsed_seconds, 2)
+        }
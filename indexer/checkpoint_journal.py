@@ -0,0 +1,90 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+class CheckpointJournal:
+    def __init__(self, location: str, resume: bool):
+        Path(location).parent.mkdir(exist_ok=True, parents=True)
+        self.__document_entries = {}
+        self.__first_chunk_numbers = {}
+        self.__lock = threading.Lock()
+        self.last_entry = None
+
+        if resume and Path(location).exists():
+            with open(location) as f:
+                for line in f:
+                    line = line.strip()
+                    if len(line) == 0:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # a crash in the middle of a write leaves a torn last line, everything before it is still good
+                        print(f"Ignoring partially written checkpoint: {line[:100]}")
+                        break
+                    self.__document_entries[entry["document"]] = entry
+                    self.last_entry = entry
+            print(f"Loaded checkpoints for {len(self.__document_entries)} document(s) from {location}")
+
+        self.__file = open(location, "a" if resume else "w")
+
+    def __append(self, entry):
+        # every entry is forced to disk so it survives the process dying right after the upload it describes
+        # documents can be indexed in parallel so the lock keeps their lines from interleaving
+        with self.__lock:
+            self.__file.write(json.dumps(entry) + "\n")
+            self.__file.flush()
+            os.fsync(self.__file.fileno())
+            self.__document_entries[entry["document"]] = entry
+            self.last_entry = entry
+
+    def get_document_entry(self, document_name: str):
+        return self.__document_entries.get(document_name)
+
+    def get_document_entries(self):
+        return list(self.__document_entries.values())
+
+    def start_document(self, document_name: str, first_chunk_number: int, total_chunks: int, total_chunks_uploaded: int):
+        self.__first_chunk_numbers[document_name] = first_chunk_number
+        self.__append({
+            "document": document_name,
+            "status": "started",
+            "firstChunkNumber": first_chunk_number,
+            "totalChunks": total_chunks,
+            "totalChunksUploaded": total_chunks_uploaded
+        })
+
+    def continue_document(self, document_name: str, first_chunk_number: int):
+        self.__first_chunk_numbers[document_name] = first_chunk_number
+
+    def record_progress(self, document_name: str, page_number: int, remaining_page_chunks: list[str], spool_state):
+        self.__append({
+            "document": document_name,
+            "status": "inProgress",
+            "firstChunkNumber": self.__first_chunk_numbers[document_name],
+            "pageNumber": page_number,
+            "remainingPageChunks": remaining_page_chunks,
+            "spool": spool_state
+        })
+
+    def complete_document(self, document_name: str, total_chunks: int, total_chunks_uploaded: int):
+        self.__append({
+            "document": document_name,
+            "status": "complete",
+            "firstChunkNumber": self.__first_chunk_numbers[document_name],
+            "totalChunks": total_chunks,
+            "totalChunksUploaded": total_chunks_uploaded
+        })
+
+    def get_resume_totals(self):
+        if self.last_entry is None:
+            return None
+
+        if self.last_entry["status"] == "inProgress":
+            return (self.last_entry["spool"]["totalChunks"], self.last_entry["spool"]["totalChunksUploaded"])
+
+        return (self.last_entry["totalChunks"], self.last_entry["totalChunksUploaded"])
+
+    def close(self):
+        self.__file.close()
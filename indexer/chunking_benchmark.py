@@ -0,0 +1,70 @@
+import sys
+import json
+import time
+import statistics
+import pdfplumber
+from app import normalize_text, count_tokens, chunk_text_with_ai, chunk_text_locally, get_openai_client
+
+def summarize_run(name: str, page_chunks: list[list[str]], page_seconds: list[float]):
+    chunk_tokens = sorted(count_tokens(chunk) for chunks in page_chunks for chunk in chunks if len(chunk.strip()) > 0)
+
+    def percentile(p):
+        return chunk_tokens[min(len(chunk_tokens) - 1, int(len(chunk_tokens) * p))] if len(chunk_tokens) > 0 else 0
+
+    return {
+        "chunker": name,
+        "pages": len(page_chunks),
+        "chunkCount": len(chunk_tokens),
+        "tokens": {
+            "total": sum(chunk_tokens),
+            "min": chunk_tokens[0] if len(chunk_tokens) > 0 else 0,
+            "mean": round(statistics.mean(chunk_tokens), 1) if len(chunk_tokens) > 0 else 0,
+            "p50": percentile(0.5),
+            "p90": percentile(0.9),
+            "max": chunk_tokens[-1] if len(chunk_tokens) > 0 else 0,
+            "stdev": round(statistics.pstdev(chunk_tokens), 1) if len(chunk_tokens) > 0 else 0
+        },
+        "wallSeconds": round(sum(page_seconds), 3),
+        "msPerPage": round(1000 * statistics.mean(page_seconds), 2) if len(page_seconds) > 0 else 0
+    }
+
+def run_chunker(name: str, page_texts: list[str], chunker):
+    page_chunks = []
+    page_seconds = []
+    for i, text in enumerate(page_texts):
+        start = time.perf_counter()
+        page_chunks.append(chunker(text))
+        page_seconds.append(time.perf_counter() - start)
+        print(f"{name}: chunked page {i+1} of {len(page_texts)}", file=sys.stderr)
+
+    return summarize_run(name, page_chunks, page_seconds)
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python chunking_benchmark.py <pdf_path> [max_pages] [--skip-ai]")
+        sys.exit(1)
+
+    pdf_path = sys.argv[1]
+    max_pages = int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].isdigit() else None
+    skip_ai = "--skip-ai" in sys.argv
+
+    page_texts = []
+    with pdfplumber.open(pdf_path) as pdf:
+        pages = pdf.pages if max_pages is None else pdf.pages[:max_pages]
+        for page in pages:
+            page_text = page.extract_text()
+            page.flush_cache()
+            normalized_text = normalize_text(page_text or "")
+            # same cut off the indexer uses for pages that have nothing worth indexing
+            if len(normalized_text) > 3:
+                page_texts.append(normalized_text)
+
+    results = [run_chunker("local", page_texts, chunk_text_locally)]
+    if not skip_ai:
+        openai_client = get_openai_client()
+        results.append(run_chunker("ai", page_texts, lambda text: chunk_text_with_ai(text, openai_client)))
+
+    print(json.dumps(results, indent=4))
+
+if __name__ == "__main__":
+    main()
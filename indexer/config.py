@@ -125,8 +125,51 @@ __configuration = {
         "CONTAINER_NAME": "pricingregulations",
         "ChunkSize": 30,
         "Overlap": 3,
+        "StoreChunkNeighbors": False,
         "ChunkingCharacter":". ",
-        "SpoolingSize": 50
+        "SpoolingSize": 50,
+        "OcrWorkers": os.cpu_count(),
+        "RenderWindowSize": 32,
+        "RenderMemoryLimitMB": 2048,
+        "RenderThreads": 2,
+        "EmbeddingsBatchSize": 64,
+        "EmbeddingsBatchTokens": 100000,
+        "MaxConcurrentChunking": 8,
+        "EmbeddingCacheLocation": "C:\\src\\data\\embedding_cache.sqlite",
+        "EmbeddingCacheMaxMB": 4096,
+        "ArtifactCacheLocation": "C:\\src\\data\\artifact_cache.sqlite",
+        "RenderDpi": 200,
+        "CosmosBulkMode": "batch",
+        "CosmosMaxConcurrency": 8,
+        "IncrementalIndexing": True,
+        "CheckpointJournalLocation": "C:\\src\\data\\checkpoints",
+        "UseTextLayerWhenUsable": True,
+        "MinTextLayerDensity": 5.0,
+        "MaxTextLayerGarbageRatio": 0.1,
+        "UseLocalChunking": False,
+        "LocalChunkTargetTokens": 120,
+        "LocalChunkMaxTokens": 250,
+        "UsePipelinedIndexing": False,
+        "RenderWorkers": 2,
+        "EmbeddingWorkers": 4,
+        "PipelineQueueSize": 16,
+        "MaxConcurrentDocuments": 1,
+        "ChunkIdRangeSize": 100000,
+        "ChatTokensPerMinute": 150000,
+        "ChatRequestsPerMinute": 900,
+        "EmbeddingsTokensPerMinute": 350000,
+        "EmbeddingsRequestsPerMinute": 2100,
+        "ChatMaxConcurrency": 16,
+        "EmbeddingsMaxConcurrency": 8,
+        "OpenAIMaxRetries": 8,
+        "PdfplumberWorkers": os.cpu_count(),
+        "PdfplumberPagesPerTask": 25,
+        "InMemoryOcr": True,
+        "SaveDebugImages": False,
+        "RunReportLocation": "C:\\src\\data\\run_reports",
+        "LiveSummaryIntervalSeconds": 60,
+        "VectorStore": "cosmos",
+        "LocalVectorStoreLocation": "C:\\src\\data\\vector_store"
     }
 }
 
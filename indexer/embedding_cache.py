@@ -0,0 +1,95 @@
+import sqlite3
+import hashlib
+import threading
+import time
+import re
+from array import array
+from pathlib import Path
+
+def float32_to_list(values: array):
+    # tolist() widens each float32 to a double which json then writes out with 17 digits, 9 significant digits
+    # are all a float32 holds and keep every stored vector about a third smaller
+    return [float(f"{value:.9g}") for value in values]
+
+class EmbeddingCache:
+    def __init__(self, location: str, max_size_mb: int):
+        Path(location).parent.mkdir(exist_ok=True, parents=True)
+        self.__max_size = max_size_mb * 1024 * 1024
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(location, check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                lastUsed REAL NOT NULL
+            )
+        """)
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (lastUsed)")
+        self.__connection.commit()
+
+        self.hits = 0
+        self.misses = 0
+
+    def __get_key(self, text: str, model: str):
+        # whitespace differences don't change what gets embedded in any meaningful way so don't let them bust the cache
+        normalized_text = re.sub(r'\s+', ' ', text).strip()
+        return hashlib.sha256(f"{model}\0{normalized_text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: list[str], model: str):
+        keys = [self.__get_key(text, model) for text in texts]
+        found = {}
+        with self.__lock:
+            # sqlite caps the number of bound parameters so look the keys up in slices
+            for start in range(0, len(keys), 500):
+                key_slice = keys[start:start + 500]
+                placeholders = ",".join("?" * len(key_slice))
+                for (key, vector) in self.__connection.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", key_slice):
+                    found[key] = float32_to_list(array("f", vector))
+
+            if len(found) > 0:
+                now = time.time()
+                self.__connection.executemany("UPDATE embeddings SET lastUsed = ? WHERE key = ?", [(now, key) for key in found])
+                self.__connection.commit()
+
+        embeddings = [found.get(key) for key in keys]
+        hits = len([e for e in embeddings if e is not None])
+        self.hits += hits
+        self.misses += len(embeddings) - hits
+        return embeddings
+
+    def put_many(self, texts: list[str], embeddings: list[list[float]], model: str):
+        now = time.time()
+        rows = []
+        for (text, embedding) in zip(texts, embeddings):
+            vector = array("f", embedding).tobytes()
+            rows.append((self.__get_key(text, model), model, vector, len(vector), now))
+
+        with self.__lock:
+            self.__connection.executemany("INSERT OR REPLACE INTO embeddings (key, model, vector, size, lastUsed) VALUES (?, ?, ?, ?, ?)", rows)
+            self.__connection.commit()
+            self.__evict()
+
+    def __evict(self):
+        (total_size,) = self.__connection.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        if total_size <= self.__max_size:
+            return
+
+        # trim down below the limit so we aren't evicting again on every single insert
+        target_size = self.__max_size * 0.9
+        evicted_keys = []
+        for (key, size) in self.__connection.execute("SELECT key, size FROM embeddings ORDER BY lastUsed ASC").fetchall():
+            if total_size <= target_size:
+                break
+            evicted_keys.append((key,))
+            total_size -= size
+
+        self.__connection.executemany("DELETE FROM embeddings WHERE key = ?", evicted_keys)
+        self.__connection.commit()
+        print(f"Evicted {len(evicted_keys)} embeddings from the cache")
+
+    def close(self):
+        with self.__lock:
+            self.__connection.close()
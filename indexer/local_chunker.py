@@ -0,0 +1,91 @@
+import re
+
+# abbreviations that end in a period but almost never end a sentence in a regulation
+ABBREVIATIONS = {
+    "mr", "mrs", "ms", "dr", "st", "no", "nos", "sec", "secs", "fig", "vol", "inc", "ltd", "co", "corp",
+    "vs", "e.g", "i.e", "u.s", "u.s.c", "c.f.r", "cf", "al", "pp", "para", "approx", "etc", "jan", "feb",
+    "mar", "apr", "jun", "jul", "aug", "sept", "oct", "nov", "dec", "pub", "l", "stat", "fed", "reg"
+}
+
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])["\')\]]?\s+(?=["(\[]?[A-Z0-9§•*])')
+# numbered headings need their trailing dot or paren and at most three digits, otherwise every sentence that opens with
+# a year, a percentage or a "42 CFR 419.2" citation reads as one. section headings have to be followed by a title
+HEADING = re.compile(r'^(?:(?:[IVXLC]+\.|[A-Z]\.|\(?\d{1,3}\)|\d{1,3}(?:\.\d+)*[.)])\s+\S|(?:Section|SECTION|§)\s?\d+(?:\.\d+)*\s+[A-Z])')
+
+def split_sentences(text: str):
+    sentences = []
+    start = 0
+    for boundary in SENTENCE_BOUNDARY.finditer(text):
+        candidate = text[start:boundary.start()].strip()
+        last_word = candidate.split(" ")[-1].rstrip(".!?\"')]").lower() if candidate else ""
+        # "42 U.S.C. 1395" shouldn't be three sentences and "II." on its own is a section marker, not a sentence
+        if last_word in ABBREVIATIONS or (len(last_word) == 1 and last_word.isalpha()) or " " not in candidate:
+            continue
+
+        sentences.append(candidate)
+        start = boundary.end()
+
+    remaining = text[start:].strip()
+    if len(remaining) > 0:
+        sentences.append(remaining)
+
+    return [s for s in sentences if len(s) > 0]
+
+def is_heading(sentence: str):
+    words = sentence.split(" ")
+    if len(words) > 15:
+        return False
+
+    if HEADING.match(sentence):
+        return True
+
+    letters = [c for c in sentence if c.isalpha()]
+    return len(letters) >= 4 and len([c for c in letters if c.isupper()]) / len(letters) > 0.8
+
+def split_oversized_sentence(sentence: str, max_tokens: int, count_tokens):
+    # a run-on "sentence" (tables, lists OCR'd without punctuation) gets cut on word boundaries instead
+    pieces = []
+    current = []
+    for word in sentence.split(" "):
+        if len(current) > 0 and count_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+
+    if len(current) > 0:
+        pieces.append(" ".join(current))
+
+    return pieces
+
+def chunk_sentences(text: str, target_tokens: int, max_tokens: int, count_tokens):
+    chunks = []
+    current = []
+    current_tokens = 0
+
+    def flush():
+        nonlocal current, current_tokens
+        if len(current) > 0:
+            chunks.append(" ".join(current))
+        current = []
+        current_tokens = 0
+
+    for sentence in split_sentences(text):
+        sentence_tokens = count_tokens(sentence)
+
+        # keep headings with the content that follows them instead of the tail of the previous section
+        if is_heading(sentence):
+            flush()
+
+        if sentence_tokens > max_tokens:
+            flush()
+            chunks.extend(split_oversized_sentence(sentence, max_tokens, count_tokens))
+            continue
+
+        if len(current) > 0 and current_tokens + sentence_tokens > target_tokens:
+            flush()
+
+        current.append(sentence)
+        current_tokens += sentence_tokens
+
+    flush()
+    return chunks
@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from vector_store import VectorStore
+
+class LocalVectorStore(VectorStore):
+    # items live in SQLite without their vectors, the vectors are fixed size float32 rows in a flat file that the API
+    # memory maps for searching. every item with a vector owns a slot (row) in that file and deleted slots get reused
+    def __init__(self, location: str):
+        Path(location).mkdir(exist_ok=True, parents=True)
+        self.__vectors_location = Path(location).joinpath("vectors.f32")
+        self.__vectors_location.touch()
+        self.__vectors_file = open(self.__vectors_location, "r+b")
+        self.__lock = threading.Lock()
+        self.__connection = sqlite3.connect(str(Path(location).joinpath("items.sqlite")), check_same_thread=False)
+        self.__connection.execute("PRAGMA journal_mode=WAL")
+        self.__connection.execute('''
+            CREATE TABLE IF NOT EXISTS items (
+                partitionKey TEXT NOT NULL,
+                id TEXT NOT NULL,
+                documentType TEXT,
+                item TEXT NOT NULL,
+                slot INTEGER,
+                PRIMARY KEY (partitionKey, id)
+            )
+        ''')
+        self.__connection.execute("CREATE INDEX IF NOT EXISTS itemsDocumentType ON items (partitionKey, documentType)")
+        self.__connection.execute("CREATE TABLE IF NOT EXISTS freeSlots (slot INTEGER PRIMARY KEY)")
+        self.__connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        self.__connection.commit()
+
+        dimensions = self.__connection.execute("SELECT value FROM settings WHERE name = 'dimensions'").fetchone()
+        self.__dimensions = int(dimensions[0]) if dimensions is not None else None
+        self.__slot_count = self.__vectors_location.stat().st_size // (self.__dimensions * 4) if self.__dimensions else 0
+
+        self.items_written = 0
+        self.items_deleted = 0
+        self.elapsed_seconds = 0.0
+
+    def __allocate_slot(self):
+        free_slot = self.__connection.execute("SELECT MIN(slot) FROM freeSlots").fetchone()[0]
+        if free_slot is not None:
+            self.__connection.execute("DELETE FROM freeSlots WHERE slot = ?", (free_slot,))
+            return free_slot
+
+        self.__slot_count += 1
+        return self.__slot_count - 1
+
+    def __write_vector(self, slot: int, vector: list[float]):
+        if self.__dimensions is None:
+            self.__dimensions = len(vector)
+            self.__connection.execute("INSERT INTO settings (name, value) VALUES ('dimensions', ?)", (str(self.__dimensions),))
+        elif len(vector) != self.__dimensions:
+            raise ValueError(f"Expected a vector with {self.__dimensions} dimensions but got {len(vector)}")
+
+        self.__vectors_file.seek(slot * self.__dimensions * 4)
+        self.__vectors_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+
+    def __read_vectors(self, slots: list[int]):
+        self.__vectors_file.flush()
+        vectors = np.memmap(self.__vectors_location, dtype=np.float32, mode="r", shape=(self.__slot_count, self.__dimensions))
+        # fancy indexing copies just the rows we asked for out of the map
+        return vectors[np.asarray(slots, dtype=np.int64)]
+
+    def upsert_items(self, items: list[dict]):
+        start = time.perf_counter()
+        with self.__lock:
+            for item in items:
+                existing = self.__connection.execute("SELECT slot FROM items WHERE partitionKey = ? AND id = ?", (item["partitionKey"], item["id"])).fetchone()
+                slot = existing[0] if existing is not None else None
+                vector = item.get("vector")
+                if vector is not None:
+                    if slot is None:
+                        slot = self.__allocate_slot()
+                    self.__write_vector(slot, vector)
+                elif slot is not None:
+                    self.__connection.execute("INSERT INTO freeSlots (slot) VALUES (?)", (slot,))
+                    slot = None
+
+                stored_item = { key: value for (key, value) in item.items() if key != "vector" }
+                self.__connection.execute(
+                    "INSERT OR REPLACE INTO items (partitionKey, id, documentType, item, slot) VALUES (?, ?, ?, ?, ?)",
+                    (item["partitionKey"], item["id"], item.get("documentType"), json.dumps(stored_item), slot)
+                )
+
+            self.__vectors_file.flush()
+            self.__connection.commit()
+            self.items_written += len(items)
+            self.elapsed_seconds += time.perf_counter() - start
+
+    def upsert_item(self, item: dict):
+        self.upsert_items([item])
+
+    def delete_items(self, item_ids: list[str], partition_key: str):
+        start = time.perf_counter()
+        deleted = 0
+        with self.__lock:
+            for item_id in item_ids:
+                existing = self.__connection.execute("SELECT slot FROM items WHERE partitionKey = ? AND id = ?", (partition_key, item_id)).fetchone()
+                if existing is None:
+                    continue
+
+                if existing[0] is not None:
+                    self.__connection.execute("INSERT INTO freeSlots (slot) VALUES (?)", (existing[0],))
+                self.__connection.execute("DELETE FROM items WHERE partitionKey = ? AND id = ?", (partition_key, item_id))
+                deleted += 1
+
+            self.__connection.commit()
+            self.items_deleted += deleted
+            self.elapsed_seconds += time.perf_counter() - start
+
+        print(f"Deleted {deleted} items")
+        return deleted
+
+    def read_item(self, item_id: str, partition_key: str):
+        with self.__lock:
+            row = self.__connection.execute("SELECT item, slot FROM items WHERE partitionKey = ? AND id = ?", (partition_key, item_id)).fetchone()
+            if row is None:
+                return None
+
+            item = json.loads(row[0])
+            if row[1] is not None:
+                item["vector"] = self.__read_vectors([row[1]])[0].tolist()
+            return item
+
+    def query_document_type_ids(self, partition_key: str, document_type: str):
+        with self.__lock:
+            rows = self.__connection.execute("SELECT id FROM items WHERE partitionKey = ? AND documentType = ?", (partition_key, document_type)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_report(self):
+        elapsed_seconds = self.elapsed_seconds if self.elapsed_seconds > 0 else 1
+        return {
+            "itemsWritten": self.items_written,
+            "itemsDeleted": self.items_deleted,
+            "slots": self.__slot_count,
+            "elapsedSeconds": round(self.elapsed_seconds, 2),
+            "itemsPerSecond": round((self.items_written + self.items_deleted) / elapsed_seconds, 2)
+        }
+
+    def close(self):
+        with self.__lock:
+            self.__vectors_file.close()
+            self.__connection.close()
@@ -0,0 +1,158 @@
+import asyncio
+import random
+import threading
+import time
+from openai import RateLimitError, APIConnectionError, InternalServerError
+from rate_limiter import RateLimiter
+
+# APITimeoutError is an APIConnectionError so it's covered as well
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, InternalServerError)
+
+def get_retry_after(error):
+    response = getattr(error, "response", None)
+    headers = response.headers if response is not None else {}
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        return float(retry_after_ms) / 1000
+
+    retry_after = headers.get("retry-after")
+    try:
+        return float(retry_after) if retry_after else None
+    except ValueError:
+        # retry-after can also be an http date, just fall back to our own backoff for those
+        return None
+
+class OpenAIThrottle:
+    def __init__(self, name: str, rate_limiter: RateLimiter = None, max_concurrency: int = 16, max_retries: int = 8):
+        self.__name = name
+        self.__rate_limiter = rate_limiter
+        self.__max_concurrency = max_concurrency
+        self.__max_retries = max_retries
+        self.__condition = threading.Condition()
+
+        # AIMD, the limit halves when azure throttles us and creeps back up by one per round of successful requests
+        self.__concurrency_limit = float(max_concurrency)
+        self.__in_flight = 0
+        self.__paused_until = 0.0
+        self.__last_decrease = 0.0
+
+        self.requests = 0
+        self.throttles = 0
+        self.retries = 0
+        self.failures = 0
+
+    def __try_enter(self):
+        # returns 0 once a slot is taken, otherwise how long the caller should hold off, None meaning until a slot frees up
+        now = time.monotonic()
+        if self.__paused_until > now:
+            return self.__paused_until - now
+
+        if self.__in_flight >= max(1, int(self.__concurrency_limit)):
+            return None
+
+        self.__in_flight += 1
+        self.requests += 1
+        return 0
+
+    def __enter(self):
+        with self.__condition:
+            while (wait_seconds := self.__try_enter()) != 0:
+                self.__condition.wait(wait_seconds)
+
+    async def __enter_async(self):
+        # the condition can't be awaited so the async path polls instead of blocking the event loop
+        while True:
+            with self.__condition:
+                wait_seconds = self.__try_enter()
+            if wait_seconds == 0:
+                return
+            await asyncio.sleep(wait_seconds if wait_seconds is not None else 0.05)
+
+    def __exit(self, succeeded: bool, throttled: bool = False, retry_after: float = None):
+        with self.__condition:
+            self.__in_flight -= 1
+            now = time.monotonic()
+            if throttled:
+                self.throttles += 1
+                # a throttle means the whole deployment is over quota, so every caller waits it out and not just this one
+                if retry_after is not None:
+                    self.__paused_until = max(self.__paused_until, now + retry_after)
+                # throttles arrive in bursts from requests that were already in flight, only back off once per burst
+                if now - self.__last_decrease > max(1.0, retry_after or 0):
+                    self.__concurrency_limit = max(1.0, self.__concurrency_limit / 2)
+                    self.__last_decrease = now
+                    print(f"{self.__name} throttled, concurrency limit is now {int(self.__concurrency_limit)}")
+            elif succeeded:
+                self.__concurrency_limit = min(float(self.__max_concurrency), self.__concurrency_limit + 1 / self.__concurrency_limit)
+            self.__condition.notify_all()
+
+    def __handle_error(self, error, attempt: int):
+        # returns how long to wait before retrying or raises once we're out of retries
+        throttled = isinstance(error, RateLimitError)
+        retry_after = get_retry_after(error)
+        self.__exit(False, throttled, retry_after)
+
+        if attempt >= self.__max_retries:
+            with self.__condition:
+                self.failures += 1
+            raise error
+
+        with self.__condition:
+            self.retries += 1
+
+        # jitter keeps every caller that was throttled at the same time from coming back at the same time too
+        delay = retry_after if retry_after is not None else min(2 ** attempt, 60)
+        delay = delay * random.uniform(1, 1.25)
+        print(f"{self.__name} request failed with {type(error).__name__}, retrying in {delay:.2f}s (attempt {attempt + 1} of {self.__max_retries})")
+        return delay
+
+    def call(self, tokens: int, operation):
+        attempt = 0
+        while True:
+            if self.__rate_limiter is not None:
+                self.__rate_limiter.acquire(tokens)
+            self.__enter()
+            try:
+                result = operation()
+            except RETRYABLE_ERRORS as e:
+                time.sleep(self.__handle_error(e, attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.__exit(False)
+                raise
+
+            self.__exit(True)
+            return result
+
+    async def call_async(self, tokens: int, operation):
+        attempt = 0
+        while True:
+            if self.__rate_limiter is not None:
+                await self.__rate_limiter.acquire_async(tokens)
+            await self.__enter_async()
+            try:
+                result = await operation()
+            except RETRYABLE_ERRORS as e:
+                await asyncio.sleep(self.__handle_error(e, attempt))
+                attempt += 1
+                continue
+            except BaseException:
+                self.__exit(False)
+                raise
+
+            self.__exit(True)
+            return result
+
+    def get_report(self):
+        report = {
+            "requests": self.requests,
+            "throttles": self.throttles,
+            "retries": self.retries,
+            "failures": self.failures,
+            "concurrencyLimit": int(self.__concurrency_limit)
+        }
+        if self.__rate_limiter is not None:
+            report["rateLimiter"] = self.__rate_limiter.get_report()
+
+        return report
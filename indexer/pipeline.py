@@ -0,0 +1,186 @@
+import queue
+import threading
+import time
+
+# marks the end of the stream on a stage's input queue
+END_OF_STREAM = object()
+
+class PipelineAborted(Exception):
+    pass
+
+class PipelineStage:
+    def __init__(self, name: str, function, workers: int = 1, ordered: bool = False, on_finish = None):
+        # function takes one payload and returns a list of payloads for the next stage, an empty list drops it
+        # ordered stages run a single worker and see their input in the same order the source produced it
+        # on_finish runs once after the last input of an ordered stage and returns any trailing payloads
+        self.name = name
+        self.function = function
+        self.workers = 1 if ordered else max(1, workers)
+        self.ordered = ordered
+        self.on_finish = on_finish
+
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.waiting_for_input_seconds = 0.0
+        self.blocked_on_output_seconds = 0.0
+
+class Pipeline:
+    def __init__(self, stages: list[PipelineStage], queue_size: int = 16):
+        self.__stages = stages
+        self.__queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.__lock = threading.Lock()
+        self.__abort = threading.Event()
+        self.__errors = []
+        self.__elapsed_seconds = 0.0
+        self.__source_items = 0
+
+    def is_aborted(self):
+        # stage functions that wait on something other than the queues check this so a failed run doesn't leave them stuck
+        return self.__abort.is_set()
+
+    def __put(self, queue_index: int, envelope):
+        while not self.__abort.is_set():
+            try:
+                self.__queues[queue_index].put(envelope, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted()
+
+    def __get(self, queue_index: int):
+        while not self.__abort.is_set():
+            try:
+                return self.__queues[queue_index].get(timeout=0.5)
+            except queue.Empty:
+                continue
+        raise PipelineAborted()
+
+    def __forward(self, stage_index: int, envelope):
+        # the last stage's output goes nowhere
+        if stage_index + 1 >= len(self.__stages):
+            return
+
+        stage = self.__stages[stage_index]
+        start = time.perf_counter()
+        self.__put(stage_index + 1, envelope)
+        with self.__lock:
+            stage.blocked_on_output_seconds += time.perf_counter() - start
+
+    def __process(self, stage: PipelineStage, payloads: list):
+        outputs = []
+        start = time.perf_counter()
+        for payload in payloads:
+            outputs.extend(stage.function(payload))
+        with self.__lock:
+            stage.busy_seconds += time.perf_counter() - start
+            stage.items += len(payloads)
+        return outputs
+
+    def __run_worker(self, stage_index: int, finished_workers: list[int]):
+        # every envelope is (source sequence, payloads) and each stage emits exactly one envelope per envelope it receives,
+        # that keeps the sequence numbers contiguous so an ordered stage always knows which envelope comes next
+        stage = self.__stages[stage_index]
+        pending = {}
+        next_sequence = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                envelope = self.__get(stage_index)
+                with self.__lock:
+                    stage.waiting_for_input_seconds += time.perf_counter() - start
+
+                if envelope is END_OF_STREAM:
+                    break
+
+                if not stage.ordered:
+                    (sequence, payloads) = envelope
+                    self.__forward(stage_index, (sequence, self.__process(stage, payloads)))
+                    continue
+
+                pending[envelope[0]] = envelope[1]
+                while next_sequence in pending:
+                    self.__forward(stage_index, (next_sequence, self.__process(stage, pending.pop(next_sequence))))
+                    next_sequence += 1
+
+            if stage.ordered and stage.on_finish is not None:
+                start = time.perf_counter()
+                trailing_payloads = stage.on_finish()
+                with self.__lock:
+                    stage.busy_seconds += time.perf_counter() - start
+                self.__forward(stage_index, (next_sequence, trailing_payloads))
+        except PipelineAborted:
+            return
+        except Exception as e:
+            with self.__lock:
+                self.__errors.append(e)
+            self.__abort.set()
+            return
+
+        with self.__lock:
+            finished_workers[stage_index] += 1
+            last_worker = finished_workers[stage_index] == stage.workers
+
+        # the last worker out tells every worker of the next stage that the stream is done
+        if last_worker and stage_index + 1 < len(self.__stages):
+            try:
+                for _ in range(self.__stages[stage_index + 1].workers):
+                    self.__put(stage_index + 1, END_OF_STREAM)
+            except PipelineAborted:
+                return
+
+    def __run_source(self, source):
+        try:
+            for payload in source:
+                self.__put(0, (self.__source_items, [payload]))
+                self.__source_items += 1
+
+            for _ in range(self.__stages[0].workers):
+                self.__put(0, END_OF_STREAM)
+        except PipelineAborted:
+            return
+        except Exception as e:
+            with self.__lock:
+                self.__errors.append(e)
+            self.__abort.set()
+
+    def run(self, source):
+        start = time.perf_counter()
+        finished_workers = [0 for _ in self.__stages]
+        threads = [threading.Thread(target=self.__run_source, args=(source,), daemon=True)]
+        for stage_index, stage in enumerate(self.__stages):
+            for _ in range(stage.workers):
+                threads.append(threading.Thread(target=self.__run_worker, args=(stage_index, finished_workers), daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.__elapsed_seconds = time.perf_counter() - start
+
+        if len(self.__errors) > 0:
+            raise self.__errors[0]
+
+        return self.get_report()
+
+    def get_report(self):
+        elapsed_seconds = self.__elapsed_seconds if self.__elapsed_seconds > 0 else 1
+        stages = []
+        for stage in self.__stages:
+            stages.append({
+                "stage": stage.name,
+                "workers": stage.workers,
+                "items": stage.items,
+                "busySeconds": round(stage.busy_seconds, 2),
+                "waitingForInputSeconds": round(stage.waiting_for_input_seconds, 2),
+                "blockedOnOutputSeconds": round(stage.blocked_on_output_seconds, 2),
+                # how much of the stage's worker time went into real work, the bottleneck sits close to 1
+                "utilization": round(stage.busy_seconds / (stage.workers * elapsed_seconds), 3)
+            })
+
+        bottleneck = max(stages, key=lambda s: s["utilization"]) if len(stages) > 0 else None
+        return {
+            "elapsedSeconds": round(self.__elapsed_seconds, 2),
+            "sourceItems": self.__source_items,
+            "bottleneck": bottleneck["stage"] if bottleneck is not None else None,
+            "stages": stages
+        }
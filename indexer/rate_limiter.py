@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+
+class RateLimiter:
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int, burst_seconds: float = 10):
+        # azure enforces its per minute quotas over much shorter windows, so the buckets only hold a few seconds worth
+        # instead of letting a whole minute of requests go out at once
+        self.__token_rate = tokens_per_minute / 60
+        self.__request_rate = requests_per_minute / 60
+        self.__token_capacity = max(1.0, self.__token_rate * burst_seconds)
+        self.__request_capacity = max(1.0, self.__request_rate * burst_seconds)
+        self.__tokens = self.__token_capacity
+        self.__requests = self.__request_capacity
+        self.__last_refill = time.monotonic()
+        self.__lock = threading.Lock()
+
+        self.waits = 0
+        self.waited_seconds = 0.0
+
+    def __refill(self):
+        now = time.monotonic()
+        elapsed_seconds = now - self.__last_refill
+        self.__last_refill = now
+        self.__tokens = min(self.__token_capacity, self.__tokens + elapsed_seconds * self.__token_rate)
+        self.__requests = min(self.__request_capacity, self.__requests + elapsed_seconds * self.__request_rate)
+
+    def __try_acquire(self, tokens: int):
+        # returns 0 once the request is allowed to go, otherwise how long to wait before trying again
+        with self.__lock:
+            self.__refill()
+            # a request bigger than the bucket only waits for a full bucket and then leaves it in debt,
+            # that keeps the average rate right without waiting forever
+            required_tokens = min(tokens, self.__token_capacity)
+            if self.__tokens >= required_tokens and self.__requests >= 1:
+                self.__tokens -= tokens
+                self.__requests -= 1
+                return 0
+
+            return max((required_tokens - self.__tokens) / self.__token_rate, (1 - self.__requests) / self.__request_rate, 0.01)
+
+    def __record_wait(self, waited_seconds: float):
+        # anything this short is just the time it took to get the lock
+        if waited_seconds > 0.01:
+            with self.__lock:
+                self.waits += 1
+                self.waited_seconds += waited_seconds
+
+    def acquire(self, tokens: int):
+        start = time.monotonic()
+        while (wait_seconds := self.__try_acquire(tokens)) > 0:
+            time.sleep(wait_seconds)
+        self.__record_wait(time.monotonic() - start)
+
+    async def acquire_async(self, tokens: int):
+        start = time.monotonic()
+        while (wait_seconds := self.__try_acquire(tokens)) > 0:
+            await asyncio.sleep(wait_seconds)
+        self.__record_wait(time.monotonic() - start)
+
+    def get_report(self):
+        return {
+            "waits": self.waits,
+            "waitedSeconds": round(self.waited_seconds, 2)
+        }
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+class RunMetrics:
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__stages = {}
+        self.__sections = {}
+        self.__entries = {}
+        self.__started_at = datetime.now(timezone.utc)
+        self.__start = time.perf_counter()
+        self.__stop_live_summaries = threading.Event()
+        self.__live_summary_thread = None
+
+    def record(self, stage: str, **counters):
+        # counters are free form (items, bytes, tokens, cacheHits...) and just add up per stage
+        with self.__lock:
+            stage_counters = self.__stages.setdefault(stage, { "calls": 0, "seconds": 0.0 })
+            for (name, value) in counters.items():
+                stage_counters[name] = stage_counters.get(name, 0) + value
+
+    @contextmanager
+    def time(self, stage: str, **counters):
+        # the caller can add counters it only knows once the work is done, like the tokens reported back by the API
+        start = time.perf_counter()
+        try:
+            yield counters
+        finally:
+            self.record(stage, calls=1, seconds=time.perf_counter() - start, **counters)
+
+    def add_section(self, name: str, get_section):
+        # sections are pulled when a report is built, for things that already keep their own numbers like the bulk writer
+        self.__sections[name] = get_section
+
+    def append(self, name: str, entry):
+        with self.__lock:
+            self.__entries.setdefault(name, []).append(entry)
+
+    def get_report(self):
+        elapsed_seconds = time.perf_counter() - self.__start
+        with self.__lock:
+            stages = {}
+            for (stage, counters) in self.__stages.items():
+                stage_report = { name: round(value, 3) if isinstance(value, float) else value for (name, value) in counters.items() }
+                # rates are per second of time spent in the stage, calls that overlap make this a lower bound
+                if counters["seconds"] > 0:
+                    for name in ["items", "bytes", "tokens"]:
+                        if name in counters:
+                            stage_report[f"{name}PerSecond"] = round(counters[name] / counters["seconds"], 2)
+                stages[stage] = stage_report
+
+            entries = { name: list(values) for (name, values) in self.__entries.items() }
+
+        report = {
+            "startedAt": self.__started_at.isoformat(),
+            "elapsedSeconds": round(elapsed_seconds, 2),
+            "stages": stages
+        }
+        for (name, get_section) in self.__sections.items():
+            report[name] = get_section()
+        report.update(entries)
+        return report
+
+    def __print_live_summaries(self, interval_seconds: float):
+        while not self.__stop_live_summaries.wait(interval_seconds):
+            report = self.get_report()
+            summary = ", ".join(f"{stage} {counters['calls']} calls/{counters['seconds']:.1f}s" for (stage, counters) in report["stages"].items())
+            print(f"[{report['elapsedSeconds']:.0f}s] {summary}")
+
+    def start_live_summaries(self, interval_seconds: float):
+        if interval_seconds <= 0 or self.__live_summary_thread is not None:
+            return
+
+        self.__live_summary_thread = threading.Thread(target=self.__print_live_summaries, args=(interval_seconds,), daemon=True)
+        self.__live_summary_thread.start()
+
+    def stop_live_summaries(self):
+        if self.__live_summary_thread is None:
+            return
+
+        self.__stop_live_summaries.set()
+        self.__live_summary_thread.join()
+        self.__live_summary_thread = None
+
+    def write_report(self, location: str, run_name: str):
+        Path(location).mkdir(exist_ok=True, parents=True)
+        report = self.get_report()
+        report["run"] = run_name
+        report_path = Path(location).joinpath(f"{run_name}_{self.__started_at.strftime('%Y%m%dT%H%M%SZ')}.json")
+        with open(report_path, "w") as w:
+            w.write(json.dumps(report, indent=4))
+        return report_path
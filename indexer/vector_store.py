@@ -0,0 +1,79 @@
+from abc import ABC, abstractmethod
+from azure.cosmos import ContainerProxy
+from azure.cosmos.exceptions import CosmosResourceNotFoundError
+from bulk_writer import BulkWriter
+
+class VectorStore(ABC):
+    # everything the indexer needs from wherever the chunks end up, items are the same dicts the API reads back.
+    # searching isn't here, the API has its own reader for each backend
+    @abstractmethod
+    def upsert_items(self, items: list[dict]):
+        pass
+
+    @abstractmethod
+    def upsert_item(self, item: dict):
+        pass
+
+    @abstractmethod
+    def delete_items(self, item_ids: list[str], partition_key: str):
+        pass
+
+    @abstractmethod
+    def read_item(self, item_id: str, partition_key: str):
+        # returns None when the item doesn't exist
+        pass
+
+    @abstractmethod
+    def query_document_type_ids(self, partition_key: str, document_type: str):
+        pass
+
+    @abstractmethod
+    def get_report(self):
+        pass
+
+    def close(self):
+        pass
+
+class CosmosVectorStore(VectorStore):
+    def __init__(self, cosmos_container: ContainerProxy, mode: str = "batch", max_concurrency: int = 8):
+        self.__cosmos_container = cosmos_container
+        self.__bulk_writer = BulkWriter(cosmos_container, mode, max_concurrency)
+
+    def upsert_items(self, items: list[dict]):
+        self.__bulk_writer.upsert_items(items)
+
+    def upsert_item(self, item: dict):
+        self.__cosmos_container.upsert_item(item)
+
+    def delete_items(self, item_ids: list[str], partition_key: str):
+        return self.__bulk_writer.delete_items(item_ids, partition_key)
+
+    def read_item(self, item_id: str, partition_key: str):
+        try:
+            return self.__cosmos_container.read_item(item_id, partition_key=partition_key)
+        except CosmosResourceNotFoundError:
+            return None
+
+    def query_document_type_ids(self, partition_key: str, document_type: str):
+        # only project the id, pulling whole items drags every vector along just to read the id
+        pager = self.__cosmos_container.query_items(
+            query="SELECT VALUE c.id FROM c WHERE c.documentType = @DocumentType",
+            parameters=[{"name": "@DocumentType", "value": document_type}],
+            partition_key=partition_key,
+            max_item_count=1000
+        ).by_page()
+
+        item_ids = []
+        request_charge = 0.0
+        for page in pager:
+            request_charge += float(self.__cosmos_container.client_connection.last_response_headers.get("x-ms-request-charge", 0))
+            item_ids.extend(page)
+            print(f"Found {len(item_ids)} items so far")
+            if not pager.continuation_token:
+                break
+
+        print(f"Found {len(item_ids)} {document_type} items using {request_charge:.2f} RU")
+        return item_ids
+
+    def get_report(self):
+        return self.__bulk_writer.get_report()
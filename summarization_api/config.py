@@ -21,10 +21,19 @@ __configuration = {
         "CONTAINER_NAME": "pricingregulations",
         "Okta__Audience": "0oa1uj3zlj5hatOW91d8",
         "Okta__Issuer": "https://milliman.okta.com",
+        "JwksCacheSeconds": 3600,
+        "JwksMinRefetchSeconds": 30,
+        "VerifiedTokenCacheSize": 1024,
         "ChunkSize": 20,
         "Overlap": 5,
         "ChunkingCharacter":".",
-        "SpoolingSize": 50
+        "SpoolingSize": 50,
+        "OpenAIMaxConnections": 100,
+        "OpenAIMaxKeepAliveConnections": 20,
+        "OpenAIKeepAliveSeconds": 60,
+        "SupportedRegulationsCacheSeconds": 300,
+        "VectorStore": "cosmos",
+        "LocalVectorStoreLocation": "C:\\src\\data\\vector_store"
     }
 }
 
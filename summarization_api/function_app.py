@@ -1,15 +1,42 @@
 import azure.functions as func
+import atexit
 import json
+import logging
 from mangers.regulation_manager import RegulationManager
 from repositories.conversation_repository import ConversationRepository
+from repositories.cosmos_client import SharedCosmosClient
+from services.ai_service import AIService
 from mangers.token_manager import TokenManager
 
 
 app = func.FunctionApp()
 
+# shared so the signing keys and already verified tokens are cached across requests
+token_manager = TokenManager()
+
+def close_on_loop(loop, close):
+    # the shared clients can only be closed on the loop they were opened on, which has stopped but not closed yet at exit
+    if loop is None or loop.is_closed() or loop.is_running():
+        return
+
+    try:
+        loop.run_until_complete(close())
+    except Exception:
+        logging.exception("Failed to close shared client")
+
+@atexit.register
+def close_shared_clients():
+    # the functions host has no shutdown trigger for python apps, the worker process exiting is the closest thing to it
+    close_on_loop(SharedCosmosClient.get_loop(), SharedCosmosClient.close)
+    for loop in SharedCosmosClient.get_retired_loops():
+        close_on_loop(loop, SharedCosmosClient.close_retired)
+    close_on_loop(AIService.get_shared_client_loop(), AIService.close_shared_client)
+    for loop in AIService.get_retired_client_loops():
+        close_on_loop(loop, AIService.close_retired_clients)
+
 @app.route(route="summarize", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
 async def SummarizationAPI(req: func.HttpRequest) -> func.HttpResponse:
-    token = parse_token(req)
+    token = await parse_token(req)
     if not token:
         return func.HttpResponse(
             status_code=401
@@ -57,7 +84,7 @@ async def SummarizationAPI(req: func.HttpRequest) -> func.HttpResponse:
     
 @app.route(route="conversations/migrate", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
 async def MigrateConversationsAPI(req: func.HttpRequest) -> func.HttpResponse:
-    token = parse_token(req)
+    token = await parse_token(req)
     if not token:
         return func.HttpResponse(
             status_code=401
@@ -88,7 +115,7 @@ async def MigrateConversationsAPI(req: func.HttpRequest) -> func.HttpResponse:
     
 @app.route(route="conversations/list", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
 async def GetConversationListsAPI(req: func.HttpRequest) -> func.HttpResponse:
-    token = parse_token(req)
+    token = await parse_token(req)
     if not token:
         return func.HttpResponse(
             status_code=401
@@ -113,7 +140,7 @@ async def GetConversationListsAPI(req: func.HttpRequest) -> func.HttpResponse:
 
 @app.route(route="conversations/load", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
 async def GetConversationAPI(req: func.HttpRequest) -> func.HttpResponse:
-    token = parse_token(req)
+    token = await parse_token(req)
     if not token:
         return func.HttpResponse(
             status_code=401
@@ -147,7 +174,7 @@ async def GetConversationAPI(req: func.HttpRequest) -> func.HttpResponse:
     
 @app.route(route="regulations", auth_level=func.AuthLevel.ANONYMOUS, methods=["GET"])
 async def GetSupportedRegulationsAPI(req: func.HttpRequest) -> func.HttpResponse:
-    token = parse_token(req)
+    token = await parse_token(req)
     if not token:
         return func.HttpResponse(
             status_code=401
@@ -161,11 +188,29 @@ async def GetSupportedRegulationsAPI(req: func.HttpRequest) -> func.HttpResponse
         mimetype="application/json"
     )
 
-def parse_token(req: func.HttpRequest):
-    token_manager = TokenManager()
+@app.route(route="regulations/refresh", auth_level=func.AuthLevel.ANONYMOUS, methods=["POST"])
+async def RefreshSupportedRegulationsAPI(req: func.HttpRequest) -> func.HttpResponse:
+    # drops this worker's cached regulations so a newly published index shows up right away, other workers pick it up
+    # once their cache goes stale and the etag check sees the change
+    token = await parse_token(req)
+    if not token:
+        return func.HttpResponse(
+            status_code=401
+        )
+
+    manager = RegulationManager()
+    manager.refresh_available_regulations()
+    regulations = await manager.get_available_regulations()
+    return func.HttpResponse(
+        json.dumps(regulations),
+        status_code=200,
+        mimetype="application/json"
+    )
+
+async def parse_token(req: func.HttpRequest):
     auth_token = req.headers.get("Authorization")
     if auth_token is None:
         return None
     
     [_, token_value] = auth_token.split("Bearer ")
-    return token_manager.parse_token(token_value)
\ No newline at end of file
+    return await token_manager.parse_token(token_value)
\ No newline at end of file
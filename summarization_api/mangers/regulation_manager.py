@@ -3,6 +3,7 @@ from repositories.conversation_repository import ConversationRepository
 from services.ai_service import AIService
 import logging
 import asyncio
+import hashlib
 import re
 
 class RegulationManager:
@@ -12,18 +13,16 @@ class RegulationManager:
         self.__ai_service = AIService()
 
     async def __get_matching_regulation(self, regulation_id: str):
-        available_regulations = await self.__regulation_repository.get_available_regulations()
-        for regulation in available_regulations:
-            if regulation["partitionKey"] == regulation_id:
-                return regulation
-            
-        return None
+        return await self.__regulation_repository.get_regulation(regulation_id)
     
     async def migrate_conversations(self, old_user_id, new_user_id):
         return await self.__conversation_repository.migrate_conversations(old_user_id, new_user_id)
     
     async def get_available_regulations(self):
         return await self.__regulation_repository.get_available_regulations()
+
+    def refresh_available_regulations(self):
+        RegulationRepository.invalidate_regulations()
     
     async def get_conversations(self, user_id):
         return await self.__conversation_repository.get_conversations(user_id)
@@ -190,6 +189,23 @@ class RegulationManager:
             merged_embeddings = self.__merge_embeddings(g["text"])
             g["text"] = merged_embeddings
 
+    async def __get_fact_sheet_summary(self, regulation):
+        # the summary only depends on the fact sheet, so it's made once per version of the fact sheet and reused after that
+        fact_sheet = await self.__regulation_repository.get_fact_sheet(regulation)
+        if fact_sheet is None:
+            return None
+
+        content_hash = hashlib.sha256(fact_sheet.encode("utf-8")).hexdigest()
+        summary = await self.__regulation_repository.get_fact_sheet_summary(regulation["partitionKey"], content_hash)
+        if summary is not None:
+            logging.info("Using cached fact sheet summary")
+            return summary
+
+        summary = await self.__ai_service.summarize_text(fact_sheet)
+        if summary:
+            await self.__regulation_repository.save_fact_sheet_summary(regulation["partitionKey"], content_hash, summary)
+        return summary
+
     async def query_regulation(self, request):
         try:
             selected_regulation = await self.__get_matching_regulation(request["regulation"])
@@ -221,8 +237,7 @@ class RegulationManager:
             if selected_regulation["hasFACTSheet"] and not already_has_fact_sheet:
                 should_include_fact_sheet = await self.__ai_service.should_pull_fact_sheet(request["query"], ai_formatted_conversation_history, selected_regulation)
                 if should_include_fact_sheet:
-                    fact_sheet = await self.__regulation_repository.get_fact_sheet(selected_regulation)
-                    fact_sheet = await self.__ai_service.summarize_text(fact_sheet)
+                    fact_sheet = await self.__get_fact_sheet_summary(selected_regulation)
 
             directions = None
             response = None
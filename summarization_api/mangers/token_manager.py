@@ -1,29 +1,118 @@
-from base64 import b64decode
 import jwt
-from cryptography import x509
-from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import serialization
 import requests
 from config import get_config
 import json
 import logging
+import asyncio
+import time
+from collections import OrderedDict
 
 class TokenManager:
-    def __init__(self):
+    # meant to live for the whole worker process so the key set, the parsed keys and the verified tokens are shared by every request.
+    # load_keys can be swapped for a stub key set, it's called on a worker thread so it's fine for it to block
+    def __init__(self, load_keys = None):
         self._keys_uri = 'https://milliman.okta.com/oauth2/v1/keys'
         self._audience = get_config("Okta__Audience")
         self._issuer = get_config("Okta__Issuer")
+        self.__load_keys = load_keys if load_keys is not None else self.__request_keys
+        self.__keys_ttl_seconds = self.__get_int_config("JwksCacheSeconds", 3600)
+        self.__min_refetch_seconds = self.__get_int_config("JwksMinRefetchSeconds", 30)
+        self.__verified_token_cache_size = self.__get_int_config("VerifiedTokenCacheSize", 1024)
+
+        self.__keys = {}
+        self.__public_keys = {}
+        self.__keys_fetched_at = None
+        self.__fetch_task = None
+        self.__verified_tokens = OrderedDict()
+
+    def __get_int_config(self, key: str, default: int):
+        value = get_config(key)
+        return int(value) if value else default
+
+    def __request_keys(self):
+        response = requests.get(self._keys_uri, timeout=10)
+        response.raise_for_status()
+        return response.json()
+
+    async def __fetch_keys(self):
+        jwks = await asyncio.to_thread(self.__load_keys)
+        keys = {key['kid']: key for key in jwks['keys']}
+        # keys okta stopped publishing shouldn't keep validating tokens just because they were parsed before
+        self.__public_keys = {kid: public_key for (kid, public_key) in self.__public_keys.items() if keys.get(kid) == self.__keys.get(kid)}
+        self.__keys = keys
+        self.__keys_fetched_at = time.monotonic()
+        logging.info(f'Fetched {len(keys)} signing keys')
+
+    async def __refresh_keys(self):
+        # concurrent requests that all need the keys share a single fetch
+        if self.__fetch_task is None or self.__fetch_task.done():
+            self.__fetch_task = asyncio.ensure_future(self.__fetch_keys())
+        await self.__fetch_task
+
+    async def __refresh_keys_in_background(self):
+        try:
+            await self.__refresh_keys()
+        except:
+            logging.exception("Failed to refresh signing keys, using the cached keys until they expire")
+
+    async def __get_public_key(self, key_id: str):
+        keys_age = time.monotonic() - self.__keys_fetched_at if self.__keys_fetched_at is not None else None
+        if keys_age is None or keys_age > self.__keys_ttl_seconds:
+            await self.__refresh_keys()
+        elif keys_age > self.__keys_ttl_seconds * 0.8 and (self.__fetch_task is None or self.__fetch_task.done()):
+            # close to expiring, refresh without making this request wait for it
+            asyncio.ensure_future(self.__refresh_keys_in_background())
+        elif key_id not in self.__keys and keys_age > self.__min_refetch_seconds:
+            # probably a key okta just rotated in, refetches are spaced out so made up key ids can't hammer the endpoint
+            await self.__refresh_keys()
+
+        jwk = self.__keys.get(key_id)
+        if jwk is None:
+            return (None, None)
+
+        public_key = self.__public_keys.get(key_id)
+        if public_key is None:
+            public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
+            self.__public_keys[key_id] = public_key
+
+        return (public_key, jwk.get("alg"))
+
+    def __get_verified_token(self, token):
+        token_claims = self.__verified_tokens.get(token)
+        if token_claims is None:
+            return None
+
+        if token_claims["exp"] <= time.time():
+            del self.__verified_tokens[token]
+            return None
+
+        self.__verified_tokens.move_to_end(token)
+        return token_claims
+
+    def __add_verified_token(self, token, token_claims):
+        if "exp" not in token_claims or self.__verified_token_cache_size <= 0:
+            return
+
+        self.__verified_tokens[token] = token_claims
+        self.__verified_tokens.move_to_end(token)
+        while len(self.__verified_tokens) > self.__verified_token_cache_size:
+            self.__verified_tokens.popitem(last=False)
+
+    async def parse_token(self, token):
+        token_claims = self.__get_verified_token(token)
+        if token_claims is not None:
+            return token_claims
 
-    def parse_token(self, token):
-        jwkeys = requests.get(self._keys_uri).json()['keys']
-        jwt_header = jwt.get_unverified_header(token)
-        token_key_id = jwt_header['kid']
-        jwk = [key for key in jwkeys if key['kid'] == token_key_id][0]
-        public_key = jwt.algorithms.RSAAlgorithm.from_jwk(json.dumps(jwk))
-        pem_key = public_key.public_bytes(encoding=serialization.Encoding.PEM, format=serialization.PublicFormat.SubjectPublicKeyInfo)
         try:
-            token_claims = jwt.decode(token, pem_key, audience=self._audience, issuer=self._issuer, algorithms=[jwt_header["alg"]])
+            jwt_header = jwt.get_unverified_header(token)
+            (public_key, algorithm) = await self.__get_public_key(jwt_header['kid'])
+            if public_key is None:
+                logging.warning(f"No signing key found for key id {jwt_header['kid']}")
+                return None
+
+            token_claims = jwt.decode(token, public_key, audience=self._audience, issuer=self._issuer, algorithms=[algorithm if algorithm else jwt_header["alg"]])
+            self.__add_verified_token(token, token_claims)
             return token_claims
         except:
             logging.exception("Failed to validate JWT")
-            return None
\ No newline at end of file
+            return None
@@ -0,0 +1,82 @@
+import asyncio
+import logging
+import threading
+from config import get_config
+from azure.cosmos.aio import CosmosClient
+
+class SharedCosmosClient:
+    # one client per worker process shared by every repository, creating a client per call redid the account
+    # metadata lookup and the TLS setup every time. like any aiohttp session it belongs to the loop that opened it
+    __client = None
+    __client_loop = None
+    __containers = {}
+    __lock = threading.Lock()
+    # (loop, client) for clients replaced while their loop was stopped but not closed, they're closed at exit
+    __retired_clients = []
+
+    @staticmethod
+    def get_container(container_name: str):
+        loop = asyncio.get_running_loop()
+        with SharedCosmosClient.__lock:
+            if SharedCosmosClient.__client is None or SharedCosmosClient.__client_loop is not loop:
+                if SharedCosmosClient.__client is not None:
+                    SharedCosmosClient.__retire_client(SharedCosmosClient.__client, SharedCosmosClient.__client_loop)
+
+                logging.info('Creating shared Cosmos client')
+                SharedCosmosClient.__client = CosmosClient(get_config("COSMOS_DB_URL"), get_config("COSMOS_DB_KEY"))
+                SharedCosmosClient.__client_loop = loop
+                SharedCosmosClient.__containers = {}
+
+            container = SharedCosmosClient.__containers.get(container_name)
+            if container is None:
+                database = SharedCosmosClient.__client.get_database_client(get_config("DATABASE_NAME"))
+                container = database.get_container_client(container_name)
+                SharedCosmosClient.__containers[container_name] = container
+
+            return container
+
+    @staticmethod
+    def __retire_client(client, loop):
+        # the old client's aiohttp session belongs to its own loop so that's where it has to be closed
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+            return
+
+        if loop.is_closed():
+            logging.warning('Dropping the shared Cosmos client of an event loop that is already closed')
+            return
+
+        # a stopped loop can't run while this one is running on the same thread, so it has to wait until exit
+        logging.warning('Keeping the shared Cosmos client of a stopped event loop to close at exit')
+        SharedCosmosClient.__retired_clients = [(retired_loop, retired_client) for (retired_loop, retired_client) in SharedCosmosClient.__retired_clients if not retired_loop.is_closed()]
+        SharedCosmosClient.__retired_clients.append((loop, client))
+
+    @staticmethod
+    def get_retired_loops():
+        return [loop for (loop, _) in SharedCosmosClient.__retired_clients]
+
+    @staticmethod
+    async def close_retired():
+        # closes the retired clients that belong to the running loop
+        loop = asyncio.get_running_loop()
+        with SharedCosmosClient.__lock:
+            clients = [client for (client_loop, client) in SharedCosmosClient.__retired_clients if client_loop is loop]
+            SharedCosmosClient.__retired_clients = [(client_loop, client) for (client_loop, client) in SharedCosmosClient.__retired_clients if client_loop is not loop]
+
+        for client in clients:
+            await client.close()
+
+    @staticmethod
+    def get_loop():
+        return SharedCosmosClient.__client_loop
+
+    @staticmethod
+    async def close():
+        with SharedCosmosClient.__lock:
+            client = SharedCosmosClient.__client
+            SharedCosmosClient.__client = None
+            SharedCosmosClient.__client_loop = None
+            SharedCosmosClient.__containers = {}
+
+        if client is not None:
+            await client.close()
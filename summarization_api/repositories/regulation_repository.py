@@ -1,34 +1,74 @@
 import logging
+import re
+import time
+import datetime
+from datetime import timezone
 from config import get_config
-from azure.cosmos.aio import CosmosClient
+from repositories.vector_store import get_vector_store
 
 class RegulationRepository:
-    def get_client(self):
-        return CosmosClient(get_config("COSMOS_DB_URL"), get_config("COSMOS_DB_KEY"))
-    
-    def get_database(self, client):
-        return client.get_database_client(get_config("DATABASE_NAME"))
+    # SupportedRegulations only changes when a new index is published and /regulations gets called more than once per
+    # page load, so it's cached for the whole worker. once the cache is stale it's only read again if its etag has changed
+    __regulations = None
+    __regulations_by_partition_key = {}
+    __regulations_version = None
+    __regulations_checked_at = None
+    # partition key to (fact sheet content hash, summary)
+    __fact_sheet_summaries = {}
+
+    def __init__(self):
+        self.__vector_store = get_vector_store()
+
+    def __get_cache_seconds(self):
+        cache_seconds = get_config("SupportedRegulationsCacheSeconds")
+        return int(cache_seconds) if cache_seconds is not None else 300
+
+    @staticmethod
+    def invalidate_regulations():
+        RegulationRepository.__regulations = None
+        RegulationRepository.__regulations_by_partition_key = {}
+        RegulationRepository.__regulations_version = None
+        RegulationRepository.__regulations_checked_at = None
+
+    async def __load_regulations(self):
+        now = time.monotonic()
+        checked_at = RegulationRepository.__regulations_checked_at
+        if RegulationRepository.__regulations is not None and checked_at is not None and now - checked_at < self.__get_cache_seconds():
+            return
+
+        version = RegulationRepository.__regulations_version
+        if RegulationRepository.__regulations is not None and version is not None:
+            (modified, item) = await self.__vector_store.read_item_if_modified("SupportedRegulations", "Default", version)
+            if not modified:
+                RegulationRepository.__regulations_checked_at = now
+                return
+        else:
+            item = await self.__vector_store.read_item("SupportedRegulations", "Default")
+
+        logging.info('Loading supported regulations')
 
-    async def get_available_regulations(self):
         available_regulations = []
+        if item is not None:
+            for regulation in item["regulations"]:
+                available_regulations.append({
+                    "partitionKey": regulation["partitionKey"],
+                    "title": regulation["title"],
+                    "hasFACTSheet": regulation["hasFACTSheet"],
+                    "hierarchies":regulation["hierarchies"]
+                })
+
+        RegulationRepository.__regulations = available_regulations
+        RegulationRepository.__regulations_by_partition_key = {regulation["partitionKey"]: regulation for regulation in available_regulations}
+        RegulationRepository.__regulations_version = item.get("_etag") if item is not None else None
+        RegulationRepository.__regulations_checked_at = now
+
+    async def get_available_regulations(self):
+        await self.__load_regulations()
+        return RegulationRepository.__regulations
 
-        async with self.get_client() as client:
-            database = self.get_database(client)
-            container = database.get_container_client("pricingregulations")
-            async for item in container.query_items(
-                query="SELECT TOP 1 c.regulations FROM c WHERE c.id = 'SupportedRegulations'",
-                parameters=[],
-                partition_key=f'Default'
-            ):
-                for regulation in item["regulations"]:
-                    available_regulations.append({
-                        "partitionKey": regulation["partitionKey"],
-                        "title": regulation["title"],
-                        "hasFACTSheet": regulation["hasFACTSheet"],
-                        "hierarchies":regulation["hierarchies"]
-                    })
-
-        return available_regulations
+    async def get_regulation(self, partition_key: str):
+        await self.__load_regulations()
+        return RegulationRepository.__regulations_by_partition_key.get(partition_key)
     
     async def get_fact_sheet(self, regulation):        
         partition_key = regulation["partitionKey"]
@@ -36,27 +76,43 @@ class RegulationRepository:
         if not has_fact_sheet:
             return None
 
-        async with self.get_client() as client:
-            database = self.get_database(client)
-            container = database.get_container_client("pricingregulations")
-            items = []
-
-            logging.info('Getting fact sheet')
-
-            async for item in container.query_items(
-                query="SELECT TOP 15 c.id, c.modelType, c.text, c.pageIndex, c.documentType FROM c WHERE c.documentType = 'FactSheet' ORDER BY c.pageIndex ASC",
-                parameters=[],
-                partition_key=partition_key
-            ):
-                items.append({
-                    "id": item["id"],
-                    "modelType": item["modelType"],
-                    "text": item["text"].encode("utf-8").decode("utf-8"),
-                    "documentType": item["documentType"]
-                })
+        logging.info('Getting fact sheet')
 
-            return ' '.join([e["text"] for e in items])
+        texts = await self.__vector_store.get_fact_sheet_texts(partition_key, 15)
+        return ' '.join([text.encode("utf-8").decode("utf-8") for text in texts])
         
+    def __get_fact_sheet_summary_id(self, partition_key: str):
+        return f"FactSheetSummary_{partition_key}"
+
+    async def get_fact_sheet_summary(self, partition_key: str, content_hash: str):
+        cached = RegulationRepository.__fact_sheet_summaries.get(partition_key)
+        if cached is not None and cached[0] == content_hash:
+            return cached[1]
+
+        # summaries live in the Default partition with SupportedRegulations so they never show up in a vector search
+        item = await self.__vector_store.read_item(self.__get_fact_sheet_summary_id(partition_key), "Default")
+        if item is None or item.get("contentHash") != content_hash:
+            return None
+
+        RegulationRepository.__fact_sheet_summaries[partition_key] = (content_hash, item["summary"])
+        return item["summary"]
+
+    async def save_fact_sheet_summary(self, partition_key: str, content_hash: str, summary: str):
+        RegulationRepository.__fact_sheet_summaries[partition_key] = (content_hash, summary)
+        try:
+            await self.__vector_store.upsert_item({
+                "id": self.__get_fact_sheet_summary_id(partition_key),
+                "partitionKey": "Default",
+                "documentType": "FactSheetSummary",
+                "regulationPartitionKey": partition_key,
+                "contentHash": content_hash,
+                "summary": summary,
+                "created": str(datetime.datetime.now(timezone.utc))
+            })
+        except:
+            # the summary is still cached for this worker, the next worker to need it will just summarize it again
+            logging.exception(f"Failed to save fact sheet summary for {partition_key}")
+
     async def query_embeddings(self, embeddings: list[float], regulation):
         if not regulation:
             return []
@@ -64,24 +120,42 @@ class RegulationRepository:
         logging.info("Searching Embeddings")
         
         partition_key = regulation["partitionKey"]
-        async with self.get_client() as client:
-            database = self.get_database(client)
-            container = database.get_container_client("pricingregulations")
-            items = []
-            async for item in container.query_items(
-                query="SELECT TOP 10 c.id, c.modelType, c.text, c.pageIndex, c.documentType, VectorDistance(c.vector, @embedding) as similiarityScore FROM c ORDER BY VectorDistance(c.vector, @embedding)",
-                parameters=[dict(
-                    name="@embedding", value=embeddings
-                )],
-                partition_key= partition_key
-            ):
-                items.append({
-                    "id": item["id"],
-                    "modelType": item["modelType"],
-                    "text": item["text"].encode("utf-8").decode("utf-8"),
-                    "documentType": item["documentType"],
-                    "similiarityScore": item["similiarityScore"]
-                })
+        items = []
+        for item in await self.__vector_store.query_top_k(embeddings, partition_key, 10):
+            items.append({
+                "id": item["id"],
+                "modelType": item["modelType"],
+                "text": item["text"].encode("utf-8").decode("utf-8"),
+                "documentType": item["documentType"],
+                "similiarityScore": item["similiarityScore"],
+                "previousId": item.get("previousId"),
+                "nextId": item.get("nextId"),
+                "overlap": item.get("overlap"),
+                "overlapBefore": item.get("overlapBefore"),
+                "overlapAfter": item.get("overlapAfter")
+            })
+
+        logging.info(f'Embedding results found {len(items)}')
+        return await self.__expand_neighbor_chunks(items, partition_key)
+
+    async def __expand_neighbor_chunks(self, items, partition_key: str):
+        # chunks indexed with StoreChunkNeighbors only hold their own text, the overlap the indexer embedded them with
+        # is stored on each chunk and pulled back in here so the context reads the same as when it was stored in every chunk
+        neighbor_ids = set(item[key] for item in items for key in ["previousId", "nextId"] if item.get(key))
+        if len(neighbor_ids) == 0:
+            return items
+
+        neighbor_texts = await self.__vector_store.get_item_texts(list(neighbor_ids), partition_key)
+        for item in items:
+            # chunks indexed before the overlap was recorded per side only have the one overlap for both
+            overlap_before = item.get("overlapBefore") if item.get("overlapBefore") is not None else item.get("overlap") or 0
+            overlap_after = item.get("overlapAfter") if item.get("overlapAfter") is not None else item.get("overlap") or 0
+
+            if overlap_before > 0:
+                previous_chunks = re.findall(r"<Chunk>.*?</Chunk>", neighbor_texts.get(item.get("previousId"), ""), re.DOTALL)
+                item["text"] = ''.join(previous_chunks[-overlap_before:]) + item["text"]
+            if overlap_after > 0:
+                next_chunks = re.findall(r"<Chunk>.*?</Chunk>", neighbor_texts.get(item.get("nextId"), ""), re.DOTALL)
+                item["text"] = item["text"] + ''.join(next_chunks[:overlap_after])
 
-            logging.info(f'Embedding results found {len(items)}')
-            return items    
\ No newline at end of file
+        return items
\ No newline at end of file
@@ -0,0 +1,196 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import logging
+from pathlib import Path
+from config import get_config
+from repositories.cosmos_client import SharedCosmosClient
+from azure.core import MatchConditions
+from azure.cosmos.exceptions import CosmosResourceNotFoundError, CosmosHttpResponseError
+
+def get_fact_sheet_page_index(item_id: str):
+    # fact sheet ids end in the page index, FactSheet_10 has to come after FactSheet_2
+    page_index = item_id.split("_")[-1]
+    return int(page_index) if page_index.isdigit() else 0
+
+class CosmosVectorStore:
+    def get_container(self):
+        return SharedCosmosClient.get_container("pricingregulations")
+
+    async def read_item(self, item_id: str, partition_key: str):
+        try:
+            return await self.get_container().read_item(item_id, partition_key=partition_key)
+        except CosmosResourceNotFoundError:
+            return None
+
+    async def upsert_item(self, item: dict):
+        return await self.get_container().upsert_item(item)
+
+    async def read_item_if_modified(self, item_id: str, partition_key: str, etag: str):
+        # (False, None) while the item still has this etag, otherwise (True, the item or None when it's gone).
+        # an unchanged item comes back as a 304 with no body so checking it costs a single point read
+        try:
+            item = await self.get_container().read_item(item_id, partition_key=partition_key, etag=etag, match_condition=MatchConditions.IfModified)
+        except CosmosResourceNotFoundError:
+            return (True, None)
+        except CosmosHttpResponseError as e:
+            if e.status_code == 304:
+                return (False, None)
+            raise
+
+        if not item or "id" not in item:
+            return (False, None)
+
+        return (True, item)
+
+    async def get_fact_sheet_texts(self, partition_key: str, limit: int):
+        # the page order only lives in the id, which the query can't sort on numerically, so it's sorted here. the order
+        # has to be stable since the fact sheet summaries are keyed by a hash of these texts
+        items = []
+        async for item in self.get_container().query_items(
+            query="SELECT c.id, c.text FROM c WHERE c.documentType = 'FactSheet'",
+            parameters=[],
+            partition_key=partition_key
+        ):
+            items.append(item)
+
+        items.sort(key=lambda item: get_fact_sheet_page_index(item["id"]))
+        return [item["text"] for item in items[:limit]]
+
+    async def query_top_k(self, embeddings: list[float], partition_key: str, top_k: int):
+        items = []
+        async for item in self.get_container().query_items(
+            query="SELECT TOP @TopK c.id, c.modelType, c.text, c.documentType, c.previousId, c.nextId, c.overlap, c.overlapBefore, c.overlapAfter, VectorDistance(c.vector, @embedding) as similiarityScore FROM c ORDER BY VectorDistance(c.vector, @embedding)",
+            parameters=[dict(name="@TopK", value=top_k), dict(name="@embedding", value=embeddings)],
+            partition_key=partition_key
+        ):
+            items.append(item)
+
+        return items
+
+    async def get_item_texts(self, item_ids: list[str], partition_key: str):
+        texts = {}
+        async for item in self.get_container().query_items(
+            query="SELECT c.id, c.text FROM c WHERE ARRAY_CONTAINS(@Ids, c.id)",
+            parameters=[dict(name="@Ids", value=item_ids)],
+            partition_key=partition_key
+        ):
+            texts[item["id"]] = item["text"]
+
+        return texts
+
+class LocalVectorStore:
+    # reads what the indexer's LocalVectorStore writes: items in SQLite and their vectors as float32 rows in a flat file.
+    # everything here is blocking so it runs on a worker thread to keep the event loop free
+    def __init__(self, location: str):
+        self.__location = Path(location)
+
+    def __connect(self):
+        return sqlite3.connect(str(self.__location.joinpath("items.sqlite")))
+
+    def __read_vectors(self, connection, slots: list[int]):
+        import numpy as np
+        dimensions = int(connection.execute("SELECT value FROM settings WHERE name = 'dimensions'").fetchone()[0])
+        vectors_location = self.__location.joinpath("vectors.f32")
+        vectors = np.memmap(vectors_location, dtype=np.float32, mode="r", shape=(vectors_location.stat().st_size // (dimensions * 4), dimensions))
+        return vectors[np.asarray(slots, dtype=np.int64)]
+
+    def __read_item(self, item_id: str, partition_key: str):
+        with self.__connect() as connection:
+            row = connection.execute("SELECT item FROM items WHERE partitionKey = ? AND id = ?", (partition_key, item_id)).fetchone()
+            if row is None:
+                return None
+
+            # stands in for the etag cosmos adds to every item
+            item = json.loads(row[0])
+            item["_etag"] = hashlib.sha256(row[0].encode("utf-8")).hexdigest()
+            return item
+
+    def __upsert_item(self, item: dict):
+        # only used for small items the API keeps next to the index, none of them have a vector
+        with self.__connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO items (partitionKey, id, documentType, item, slot) VALUES (?, ?, ?, ?, NULL)",
+                (item["partitionKey"], item["id"], item.get("documentType"), json.dumps(item))
+            )
+        return item
+
+    def __read_item_if_modified(self, item_id: str, partition_key: str, etag: str):
+        item = self.__read_item(item_id, partition_key)
+        if item is not None and item["_etag"] == etag:
+            return (False, None)
+
+        return (True, item)
+
+    def __get_fact_sheet_texts(self, partition_key: str, limit: int):
+        with self.__connect() as connection:
+            rows = connection.execute("SELECT id, item FROM items WHERE partitionKey = ? AND documentType = 'FactSheet'", (partition_key,)).fetchall()
+
+        rows.sort(key=lambda row: get_fact_sheet_page_index(row[0]))
+        return [json.loads(row[1])["text"] for row in rows[:limit]]
+
+    def __query_top_k(self, embeddings: list[float], partition_key: str, top_k: int):
+        import numpy as np
+        with self.__connect() as connection:
+            rows = connection.execute("SELECT item, slot FROM items WHERE partitionKey = ? AND slot IS NOT NULL", (partition_key,)).fetchall()
+            if len(rows) == 0:
+                return []
+            candidates = self.__read_vectors(connection, [row[1] for row in rows])
+
+        # brute force cosine similarity, same ordering as VectorDistance with the cosine distance function
+        query = np.asarray(embeddings, dtype=np.float32)
+        scores = (candidates @ query) / (np.linalg.norm(candidates, axis=1) * np.linalg.norm(query) + 1e-12)
+        top_k = min(top_k, len(rows))
+        top_indexes = np.argpartition(-scores, top_k - 1)[:top_k]
+        top_indexes = top_indexes[np.argsort(-scores[top_indexes])]
+
+        items = []
+        for i in top_indexes:
+            item = json.loads(rows[i][0])
+            items.append({
+                "id": item["id"],
+                "modelType": item.get("modelType"),
+                "text": item.get("text"),
+                "documentType": item.get("documentType"),
+                "previousId": item.get("previousId"),
+                "nextId": item.get("nextId"),
+                "overlap": item.get("overlap"),
+                "overlapBefore": item.get("overlapBefore"),
+                "overlapAfter": item.get("overlapAfter"),
+                "similiarityScore": float(scores[i])
+            })
+        return items
+
+    def __get_item_texts(self, item_ids: list[str], partition_key: str):
+        with self.__connect() as connection:
+            rows = connection.execute(
+                f"SELECT id, item FROM items WHERE partitionKey = ? AND id IN ({', '.join('?' for _ in item_ids)})",
+                (partition_key, *item_ids)
+            ).fetchall()
+        return { row[0]: json.loads(row[1])["text"] for row in rows }
+
+    async def read_item(self, item_id: str, partition_key: str):
+        return await asyncio.to_thread(self.__read_item, item_id, partition_key)
+
+    async def upsert_item(self, item: dict):
+        return await asyncio.to_thread(self.__upsert_item, item)
+
+    async def read_item_if_modified(self, item_id: str, partition_key: str, etag: str):
+        return await asyncio.to_thread(self.__read_item_if_modified, item_id, partition_key, etag)
+
+    async def get_fact_sheet_texts(self, partition_key: str, limit: int):
+        return await asyncio.to_thread(self.__get_fact_sheet_texts, partition_key, limit)
+
+    async def query_top_k(self, embeddings: list[float], partition_key: str, top_k: int):
+        return await asyncio.to_thread(self.__query_top_k, embeddings, partition_key, top_k)
+
+    async def get_item_texts(self, item_ids: list[str], partition_key: str):
+        return await asyncio.to_thread(self.__get_item_texts, item_ids, partition_key)
+
+def get_vector_store():
+    if get_config("VectorStore") == "local":
+        logging.info(f'Using the local vector store at {get_config("LocalVectorStoreLocation")}')
+        return LocalVectorStore(get_config("LocalVectorStoreLocation"))
+
+    return CosmosVectorStore()
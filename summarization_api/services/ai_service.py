@@ -1,21 +1,101 @@
+import asyncio
 import logging
+import threading
+import httpx
 from config import get_config
-from openai import AsyncAzureOpenAI
+from openai import AsyncAzureOpenAI, DefaultAsyncHttpxClient
 import re
 
 class AIService:
+    # one client per worker process so every invocation and every stage of a request reuses the same warm connections.
+    # an httpx pool belongs to the event loop it was first used on, so a new loop gets a new client
+    __shared_client = None
+    __shared_client_loop = None
+    __shared_client_lock = threading.Lock()
+    # (loop, client) for clients replaced while their loop was stopped but not closed, they're closed at exit
+    __retired_clients = []
+
     def __init__(self):
         self.__api_key = get_config("AZURE_OPENAI_API_KEY")
         self.__api_endpoint = get_config("AZURE_OPENAI_ENDPOINT")
         self.__api_version = "2024-05-01-preview"
         self.__chat_model = get_config("ChatModel")
+
+    def __get_int_config(self, key: str, default: int):
+        value = get_config(key)
+        return int(value) if value else default
+
+    def __create_http_client(self):
+        return DefaultAsyncHttpxClient(
+            limits = httpx.Limits(
+                max_connections = self.__get_int_config("OpenAIMaxConnections", 100),
+                max_keepalive_connections = self.__get_int_config("OpenAIMaxKeepAliveConnections", 20),
+                keepalive_expiry = self.__get_int_config("OpenAIKeepAliveSeconds", 60)
+            )
+        )
     
     def __get_client(self):
-        return AsyncAzureOpenAI(
-            api_key = self.__api_key,
-            api_version = self.__api_version,
-            azure_endpoint = self.__api_endpoint
-        )
+        loop = asyncio.get_running_loop()
+        with AIService.__shared_client_lock:
+            if AIService.__shared_client is None or AIService.__shared_client_loop is not loop:
+                if AIService.__shared_client is not None:
+                    AIService.__retire_client(AIService.__shared_client, AIService.__shared_client_loop)
+
+                logging.info('Creating shared Azure OpenAI client')
+                AIService.__shared_client = AsyncAzureOpenAI(
+                    api_key = self.__api_key,
+                    api_version = self.__api_version,
+                    azure_endpoint = self.__api_endpoint,
+                    http_client = self.__create_http_client()
+                )
+                AIService.__shared_client_loop = loop
+
+            return AIService.__shared_client
+
+    @staticmethod
+    def __retire_client(client, loop):
+        # the old client's connections belong to its own loop so that's where it has to be closed
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(client.close(), loop)
+            return
+
+        if loop.is_closed():
+            logging.warning('Dropping the shared Azure OpenAI client of an event loop that is already closed')
+            return
+
+        # a stopped loop can't run while this one is running on the same thread, so it has to wait until exit
+        logging.warning('Keeping the shared Azure OpenAI client of a stopped event loop to close at exit')
+        AIService.__retired_clients = [(retired_loop, retired_client) for (retired_loop, retired_client) in AIService.__retired_clients if not retired_loop.is_closed()]
+        AIService.__retired_clients.append((loop, client))
+
+    @staticmethod
+    def get_retired_client_loops():
+        return [loop for (loop, _) in AIService.__retired_clients]
+
+    @staticmethod
+    async def close_retired_clients():
+        # closes the retired clients that belong to the running loop
+        loop = asyncio.get_running_loop()
+        with AIService.__shared_client_lock:
+            clients = [client for (client_loop, client) in AIService.__retired_clients if client_loop is loop]
+            AIService.__retired_clients = [(client_loop, client) for (client_loop, client) in AIService.__retired_clients if client_loop is not loop]
+
+        for client in clients:
+            await client.close()
+
+    @staticmethod
+    def get_shared_client_loop():
+        return AIService.__shared_client_loop
+
+    @staticmethod
+    async def close_shared_client():
+        with AIService.__shared_client_lock:
+            client = AIService.__shared_client
+            AIService.__shared_client = None
+            AIService.__shared_client_loop = None
+
+        if client is not None:
+            await client.close()
 
     def __get_system_prompt(self, regulation):
         if regulation["partitionKey"] in ["OPPS_2024", "OPPS_2025", "PROF_2025"]: